@@ -0,0 +1 @@
+"""Modules shared by the producers and the consumers"""
@@ -0,0 +1,102 @@
+"""Compares benchmark results with a stored baseline.
+
+Results map a name to a dict of its `value`, `unit` and whether higher is better. They are
+stored with the workload that produced them, the data and every parameter changing the results,
+and with the host they ran on. Absolute timings only say something about regressions on the
+same kind of host, so results from another host are compared with warnings instead of failures.
+"""
+import json
+import logging
+import os
+import platform
+
+
+logger = logging.getLogger(__name__)
+
+
+def describe_host():
+    """Returns the hardware and Python version the benchmarks run on"""
+    return {
+        "cpu": _cpu_model(),
+        "cpu_count": os.cpu_count(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "python": platform.python_version(),
+    }
+
+
+def write_results(path, workload, results):
+    """Writes the results as JSON with their workload and the current host"""
+    with open(path, "w") as output_file:
+        json.dump(
+            {"workload": workload, "host": describe_host(), "results": results},
+            output_file,
+            indent=2,
+            sort_keys=True,
+        )
+        output_file.write("\n")
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    """Returns a description of every result worse than its baseline by more than the
+    `tolerance` fraction. Results missing from either side are not compared.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        if result["higher_is_better"]:
+            regressed = result["value"] < expected["value"] * (1 - tolerance)
+        else:
+            regressed = result["value"] > expected["value"] * (1 + tolerance)
+        if regressed:
+            regressions.append(
+                f'{name}: {result["value"]:.2f} {result["unit"]}, '
+                f'baseline {expected["value"]:.2f} {expected["unit"]}'
+            )
+    return regressions
+
+
+def check_baseline(path, workload, results, tolerance):
+    """Logs the results regressed from the baseline written to `path` by `write_results`.
+
+    Returns True if any result regressed on the host the baseline was recorded on. Baselines
+    of another workload are skipped, and regressions on another host are only warnings.
+    """
+    if not path:
+        return False
+    if not os.path.exists(path):
+        logger.warning("no baseline at %s", path)
+        return False
+    with open(path) as baseline_file:
+        baseline = json.load(baseline_file)
+    if baseline.get("workload") != workload:
+        logger.warning("skipping baseline of another workload: %s", baseline.get("workload"))
+        return False
+
+    same_host = baseline.get("host") == describe_host()
+    if not same_host:
+        logger.warning(
+            "baseline was recorded on another host (%s), regressions are not failures",
+            baseline.get("host"),
+        )
+    regressions = compare_to_baseline(results, baseline["results"], tolerance)
+    for regression in regressions:
+        if same_host:
+            logger.error("regressed from baseline: %s", regression)
+        else:
+            logger.warning("worse than the baseline of another host: %s", regression)
+    return same_host and bool(regressions)
+
+
+def _cpu_model():
+    """Returns the CPU model name, which `platform` does not report on Linux"""
+    try:
+        with open("/proc/cpuinfo") as cpuinfo:
+            for line in cpuinfo:
+                if line.startswith("model name"):
+                    return line.split(":", 1)[1].strip()
+    except OSError:
+        pass
+    return platform.processor()
@@ -0,0 +1,255 @@
+"""Counters, gauges and histograms served at /metrics in the Prometheus text format.
+
+Recording a value is a plain attribute update on a child resolved once by `labels()`, so hot
+paths pay no lookup or locking. Values already kept by other objects are read by `Collected`
+metrics when the endpoint is scraped instead of being recorded twice.
+
+`serve` exposes the metrics from a thread of the process. The server mounts `REGISTRY.render()`
+on its own Tornado application instead.
+"""
+import bisect
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import logging
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+# Upper bounds in seconds, from a tenth of a millisecond to a few seconds
+DEFAULT_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5
+)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Registry:
+    """Holds the metrics of the process and renders them"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        """Adds the metric to the rendered ones and returns it"""
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Returns every metric in the Prometheus text format"""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for suffix, labels, value in metric.samples():
+                lines.append(f"{metric.name}{suffix}{_format_labels(labels)} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class CounterChild:
+    """Counter of a single set of label values"""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        """Adds `amount` to the counter"""
+        self.value += amount
+
+
+class GaugeChild:
+    """Gauge of a single set of label values"""
+
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        """Sets the gauge"""
+        self.value = value
+
+
+class HistogramChild:
+    """Histogram of a single set of label values, counting observations per bucket"""
+
+    __slots__ = ("upper_bounds", "bucket_counts", "sum", "count")
+
+    def __init__(self, upper_bounds):
+        self.upper_bounds = upper_bounds
+        # The last bucket counts observations above every upper bound
+        self.bucket_counts = [0] * (len(upper_bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        """Records an observation"""
+        self.bucket_counts[bisect.bisect_left(self.upper_bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class _Metric:
+    """A registered metric. Subclasses yield its samples."""
+
+    type_name = None
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        registry.register(self)
+
+    def _labels(self, values):
+        return dict(zip(self.labelnames, values))
+
+    def samples(self):
+        """Yields (name suffix, labels, value) of every sample"""
+        raise NotImplementedError
+
+
+class _RecordedMetric(_Metric):
+    """A metric whose children are created on first use of their label values"""
+
+    def __init__(self, name, documentation, labelnames=(), registry=REGISTRY):
+        self._children = {}
+        self._lock = threading.Lock()
+        super().__init__(name, documentation, labelnames, registry)
+
+    def labels(self, *values):
+        """Returns the child of the label values. Keep it to record values on hot paths."""
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            yield "", self._labels(values), child.value
+
+
+class Counter(_RecordedMetric):
+    """Monotonically increasing count"""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return CounterChild()
+
+
+class Gauge(_RecordedMetric):
+    """Value that goes up and down"""
+
+    type_name = "gauge"
+
+    def _new_child(self):
+        return GaugeChild()
+
+
+class Histogram(_RecordedMetric):
+    """Distribution of observations over cumulative buckets"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS,
+                 registry=REGISTRY):
+        self.upper_bounds = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return HistogramChild(self.upper_bounds)
+
+    def samples(self):
+        for values, child in list(self._children.items()):
+            labels = self._labels(values)
+            cumulative = 0
+            for upper_bound, bucket_count in zip(
+                    self.upper_bounds + (float("inf"),), child.bucket_counts):
+                cumulative += bucket_count
+                yield "_bucket", dict(labels, le=_format(upper_bound)), cumulative
+            yield "_sum", labels, child.sum
+            yield "_count", labels, child.count
+
+
+class Collected(_Metric):
+    """Metric read from `collect` when rendered. `collect` returns (label values, value)
+    pairs.
+    """
+
+    def __init__(self, name, documentation, type_name, labelnames, collect, registry=REGISTRY):
+        self.type_name = type_name
+        self.collect = collect
+        super().__init__(name, documentation, labelnames, registry)
+
+    def labels(self, *values):
+        """Collected metrics have no children to record values on"""
+        raise TypeError(
+            f"{self.name} is read from its collect function and has no children to record on"
+        )
+
+    def samples(self):
+        for values, value in self.collect():
+            yield "", self._labels(values), value
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    """Serves the metrics of the process"""
+
+    def do_GET(self):
+        """Responds with every metric in the Prometheus text format"""
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *_args):
+        """Scrapes are not logged"""
+
+
+def serve(port):
+    """Serves /metrics on `port` from a daemon thread. Returns the server, or None when the
+    port is not available.
+    """
+    try:
+        server = ThreadingHTTPServer(("", port), MetricsHandler)
+    except OSError as exception:
+        logger.error("unable to serve metrics on port %s: %s", port, exception)
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("serving metrics on http://localhost:%s/metrics", port)
+    return server
+
+
+def _format(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in labels.items()
+    )
+    return f"{{{pairs}}}"
@@ -0,0 +1,256 @@
+"""Sampling profiler writing collapsed stacks or speedscope profiles.
+
+A background thread samples the stack of the profiled thread, either for a period or
+continuously to keep the stacks of the slowest units of work, such as simulation ticks or
+requests. Nothing runs until one of the modes is turned on.
+"""
+import collections
+import datetime
+import heapq
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+import signal
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("collapsed", "speedscope")
+
+
+class Profiler:
+    """Samples the stack of a thread, by default the one creating the profiler.
+
+    `sample_for` samples for a period, then writes the profile. With `slowest` greater than 0
+    the thread is sampled continuously and `record` keeps the stacks of the `slowest` longest
+    units of work, written by `close`.
+    """
+
+    def __init__(self, output_dir="profiles", output_format="collapsed", interval=0.005,
+                 slowest=0, retain_seconds=30.0, thread_id=None):
+        if output_format not in FORMATS:
+            raise ValueError(f'Invalid profile format {output_format}. Expected one of {FORMATS}')
+        self.output_dir = Path(output_dir)
+        self.output_format = output_format
+        self.interval = interval
+        self.slowest = slowest
+        # Units of work longer than this are captured with the samples still retained
+        self.retain_seconds = retain_seconds
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = False
+        # Samples of the current period, stack -> count, and when the period ends
+        self._period = None
+        self._period_end = None
+        self._period_name = None
+        # (sample time, stack) of the last `retain_seconds` while keeping the slowest units
+        self._recent = collections.deque()
+        # Min-heap of (duration, sequence, label, stack counts) of the slowest units
+        self._slowest = []
+        self._sequence = itertools.count()
+        self._frame_names = {}
+
+    def sample_for(self, seconds):
+        """Samples for `seconds`, then writes the profile. Ignored while already sampling."""
+        with self._lock:
+            if self._period is not None or self._stopped:
+                return
+            self._period = collections.Counter()
+            self._period_end = time.perf_counter() + seconds
+            self._period_name = f"{seconds:g} seconds from {_now()}"
+            logger.info("profiling for %s seconds", seconds)
+            self._ensure_sampling()
+
+    def start(self):
+        """Starts sampling continuously when keeping the slowest units of work"""
+        if self.slowest > 0:
+            with self._lock:
+                self._ensure_sampling()
+
+    def record(self, duration, label_format, *label_args):
+        """Keeps the samples of a unit of work that just took `duration` seconds, if it is one
+        of the slowest. The label is only formatted for kept units.
+        """
+        if self.slowest <= 0:
+            return
+        if len(self._slowest) >= self.slowest and duration <= self._slowest[0][0]:
+            return
+        start = time.perf_counter() - duration
+        with self._lock:
+            stacks = collections.Counter(
+                stack for sampled_at, stack in self._recent if sampled_at >= start
+            )
+            capture = (duration, next(self._sequence), label_format % label_args, stacks)
+            if len(self._slowest) < self.slowest:
+                heapq.heappush(self._slowest, capture)
+            else:
+                heapq.heappushpop(self._slowest, capture)
+
+    def install_signal_handler(self, seconds, signum=signal.SIGUSR1):
+        """Samples for `seconds` whenever the process receives `signum`"""
+        def handle(_signum, _frame):
+            # The interrupted thread may hold the profiler lock, so sampling starts elsewhere
+            threading.Thread(target=self.sample_for, args=(seconds,), daemon=True).start()
+
+        signal.signal(signum, handle)
+
+    def close(self):
+        """Stops sampling and writes the profiles not written yet"""
+        with self._lock:
+            self._stopped = True
+            thread = self._thread
+        if thread is not None:
+            thread.join()
+        if self._period is not None:
+            self._write_period()
+        if self._slowest:
+            captures = sorted(self._slowest, reverse=True)
+            self._write(
+                f"slowest-{len(captures)}",
+                [
+                    (f"{label} ({duration * 1000:.1f} ms)", stacks)
+                    for duration, _, label, stacks in captures
+                ],
+            )
+            self._slowest = []
+
+    def _ensure_sampling(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._sample, name="profiler", daemon=True)
+            self._thread.start()
+
+    def _sample(self):
+        """Sampling thread loop, exits when no mode needs samples anymore"""
+        while True:
+            time.sleep(self.interval)
+            # Public since Python 3.2 despite the underscore
+            frame = sys._current_frames().get(self.thread_id)
+            stack = None if frame is None else self._stack(frame)
+            del frame
+            now = time.perf_counter()
+            with self._lock:
+                if self._stopped:
+                    self._thread = None
+                    return
+                if stack is not None and self._period is not None:
+                    self._period[stack] += 1
+                if stack is not None and self.slowest > 0:
+                    self._recent.append((now, stack))
+                    while self._recent[0][0] < now - self.retain_seconds:
+                        self._recent.popleft()
+                period_over = self._period is not None and now >= self._period_end
+            if period_over:
+                self._write_period()
+            with self._lock:
+                if self._period is None and self.slowest <= 0:
+                    self._thread = None
+                    return
+
+    @staticmethod
+    def _stack(frame):
+        """Returns the code objects of the stack, outermost first"""
+        codes = []
+        while frame is not None:
+            codes.append(frame.f_code)
+            frame = frame.f_back
+        codes.reverse()
+        return tuple(codes)
+
+    def _frame_name(self, code):
+        name = self._frame_names.get(code)
+        if name is None:
+            name = self._frame_names[code] = (
+                f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            )
+        return name
+
+    def _write_period(self):
+        with self._lock:
+            stacks, name = self._period, self._period_name
+            self._period = self._period_end = self._period_name = None
+        self._write("period", [(name, stacks)])
+
+    def _write(self, kind, captures):
+        """Writes (name, stack counts) captures to a new file of the output directory"""
+        process = multiprocessing.current_process().name
+        if process == "MainProcess":
+            process = "main"
+        stamp = datetime.datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        suffix = ".speedscope.json" if self.output_format == "speedscope" else ".collapsed"
+        path = self.output_dir / f"{process}-{kind}-{stamp}{suffix}"
+        try:
+            self.output_dir.mkdir(parents=True, exist_ok=True)
+            with open(path, "w") as profile_file:
+                if self.output_format == "speedscope":
+                    json.dump(self._speedscope(captures), profile_file)
+                else:
+                    profile_file.writelines(self._collapsed(captures))
+        except OSError as exception:
+            logger.error("unable to write profile to %s: %s", path, exception)
+            return
+        logger.info(
+            "wrote %s samples to %s",
+            sum(sum(stacks.values()) for _, stacks in captures),
+            path,
+        )
+
+    def _collapsed(self, captures):
+        """Yields `frame;frame;frame count` lines, each stack rooted at its capture name when
+        there are several captures
+        """
+        for name, stacks in captures:
+            prefix = [name.replace(";", ",")] if len(captures) > 1 else []
+            for stack, count in stacks.items():
+                frames = prefix + [self._frame_name(code).replace(";", ",") for code in stack]
+                yield f'{";".join(frames)} {count}\n'
+
+    def _speedscope(self, captures):
+        """Returns a speedscope file with a sampled profile per capture"""
+        frame_indexes = {}
+        frames = []
+        profiles = []
+        for name, stacks in captures:
+            samples = []
+            weights = []
+            for stack, count in stacks.items():
+                sample = []
+                for code in stack:
+                    index = frame_indexes.get(code)
+                    if index is None:
+                        index = frame_indexes[code] = len(frames)
+                        frames.append({
+                            "name": code.co_name,
+                            "file": code.co_filename,
+                            "line": code.co_firstlineno,
+                        })
+                    sample.append(index)
+                samples.append(sample)
+                weights.append(count * self.interval)
+            profiles.append({
+                "type": "sampled",
+                "name": name,
+                "unit": "seconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared": {"frames": frames},
+            "profiles": profiles,
+            "name": "cta profile",
+            "exporter": "profiler.py",
+        }
+
+
+def _now():
+    return datetime.datetime.now().isoformat(timespec="seconds")
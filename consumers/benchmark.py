@@ -0,0 +1,345 @@
+"""Benchmarks the consumer hot paths at a multiple of the CTA station count: serializing the
+state API, restarting the server, decoding messages and rendering the status page.
+
+Run with `python benchmark.py`. Results can be written as JSON with `--output` and are compared
+with `benchmark_baseline.json`. Exits with status 1 when a snapshot takes longer than the
+latency budget or a result regressed by more than the tolerance from a baseline recorded on the
+same kind of host.
+"""
+import argparse
+import json
+import logging
+import os
+from pathlib import Path
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Modules shared with the producers live at the repository root
+sys.path.append(str(Path(__file__).parents[1]))
+
+from checkpoint import Checkpointer
+from common.benchmarking import check_baseline, write_results
+from models import ChangeTracker, Lines, Weather
+from server import MainHandler, StatusPage
+from state_api import StateSerializer
+
+
+logger = logging.getLogger(__name__)
+
+# Stations shown on the status page for the red, green and blue lines
+CTA_STATIONS = 100
+COLORS = ("red", "green", "blue")
+DEFAULT_BASELINE = Path(__file__).parents[0] / "benchmark_baseline.json"
+
+
+class Message:
+    """Stands in for a consumed Kafka message"""
+
+    def __init__(self, value, key=None):
+        self._value = value
+        self._key = key
+
+    def value(self):
+        return self._value
+
+    def key(self):
+        return self._key
+
+
+def build_models(num_stations, seed=None, with_trains=True):
+    """Returns the change tracker and lines holding `num_stations` stations, with trains and
+    turnstile entries unless `with_trains` is False
+    """
+    rand = random.Random(seed)
+    changes = ChangeTracker()
+    lines = Lines(changes)
+    Weather(changes).process_message(Message({"temperature": 62.0, "status": "cloudy"}))
+    for station_id in range(num_stations):
+        lines.process_station_update_message(Message(json.dumps({
+            "station_id": station_id,
+            "station_name": f"station {station_id}",
+            "order": station_id,
+            "line": COLORS[station_id % len(COLORS)],
+        })))
+    if not with_trains:
+        return changes, lines
+    for station_id in range(num_stations):
+        arrive(lines, rand, station_id)
+        lines.process_turnstile_update_message(
+            Message(json.dumps({"STATION_ID": station_id, "COUNT": rand.randint(0, 5000)}))
+        )
+    return changes, lines
+
+
+def arrival_message(rand, station_id):
+    """Returns a message of a train arrival at the station"""
+    return Message({
+        "line": COLORS[station_id % len(COLORS)],
+        "station_id": station_id,
+        "train_id": f"T{rand.randint(0, 999)}",
+        "direction": rand.choice("ab"),
+        "train_status": "in_service",
+        "prev_station_id": None,
+        "prev_direction": None,
+    })
+
+
+def arrive(lines, rand, station_id):
+    """Applies a train arrival at the station"""
+    lines.process_new_arrival_message(arrival_message(rand, station_id))
+
+
+def timed(function, repeat, setup=None):
+    """Returns the durations of `repeat` calls of `function`, in milliseconds. `setup` is called
+    untimed before each call.
+    """
+    durations = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        function()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def run_benchmark(scale, repeat, changed_fraction, seed=None):
+    """Times cold and incremental snapshots and flush deltas. Returns results in milliseconds"""
+    rand = random.Random(seed)
+    num_stations = CTA_STATIONS * scale
+    changes, lines = build_models(num_stations, seed)
+    num_changed = max(1, int(num_stations * changed_fraction))
+
+    def cold_snapshot():
+        StateSerializer(changes).snapshot()
+
+    state = StateSerializer(changes)
+    state.snapshot()
+    flush_versions = []
+
+    def apply_updates():
+        flush_versions.append(changes.version)
+        for station_id in rand.sample(range(num_stations), num_changed):
+            arrive(lines, rand, station_id)
+
+    def delta():
+        state.delta(flush_versions.pop())
+
+    results = {
+        "cold_snapshot": timed(cold_snapshot, repeat),
+        "incremental_snapshot": timed(state.snapshot, repeat, apply_updates),
+    }
+    results["delta"] = timed(delta, repeat)
+    return num_stations, results
+
+
+def run_restart_benchmark(scale, repeat, history_multiples, seed=None):
+    """Times restoring a checkpoint against replaying arrival histories of `history_multiples`
+    arrivals per station. Returns results in milliseconds.
+    """
+    rand = random.Random(seed)
+    num_stations = CTA_STATIONS * scale
+    changes, lines = build_models(num_stations, seed)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as checkpoint_dir:
+        path = os.path.join(checkpoint_dir, "checkpoint.json.gz")
+        checkpointer = Checkpointer(path, changes, lines, Weather(changes), [])
+
+        def save():
+            checkpointer.saved_version = None
+            checkpointer.save()
+
+        def restore():
+            restored_changes = ChangeTracker()
+            Checkpointer(
+                path, restored_changes, Lines(restored_changes), Weather(restored_changes), []
+            ).restore()
+
+        results["checkpoint_save"] = timed(save, repeat)
+        results["checkpoint_restore"] = timed(restore, repeat)
+
+    for multiple in history_multiples:
+        history = [
+            arrival_message(rand, rand.randrange(num_stations))
+            for _ in range(num_stations * multiple)
+        ]
+        replayed = []
+
+        def fresh_models():
+            replayed[:] = [build_models(num_stations, seed, with_trains=False)[1]]
+
+        def replay():
+            replayed[0].process_new_arrival_messages(history)
+
+        results[f"replay_{len(history)}_arrivals"] = timed(
+            replay, max(1, repeat // multiple), fresh_models
+        )
+    return num_stations, results
+
+
+def run_decode_benchmark(scale, count, seed=None):
+    """Times `count` messages of each kind through the `Lines` handlers the consumers call.
+    Returns messages per second.
+    """
+    rand = random.Random(seed)
+    num_stations = CTA_STATIONS * scale
+    _, lines = build_models(num_stations, seed)
+    window_ms = 5 * 60 * 1000
+    station_messages = [
+        Message(json.dumps({
+            "station_id": station_id,
+            "station_name": f"station {station_id}",
+            "order": station_id,
+            "line": COLORS[station_id % len(COLORS)],
+        }))
+        for station_id in (rand.randrange(num_stations) for _ in range(count))
+    ]
+    arrival_messages = [
+        arrival_message(rand, rand.randrange(num_stations)) for _ in range(count)
+    ]
+    turnstile_messages = [
+        Message(json.dumps({
+            "STATION_ID": rand.randrange(num_stations),
+            "COUNT": rand.randint(0, 500),
+            "WINDOW_START": index // num_stations * window_ms,
+            "WINDOW_END": (index // num_stations + 1) * window_ms,
+        }))
+        for index in range(count)
+    ]
+
+    def per_second(function):
+        start = time.perf_counter()
+        function()
+        return count / (time.perf_counter() - start)
+
+    return {
+        "station_messages": per_second(
+            lambda: [lines.process_station_update_message(m) for m in station_messages]
+        ),
+        "arrival_messages": per_second(
+            lambda: lines.process_new_arrival_messages(arrival_messages)
+        ),
+        "turnstile_messages": per_second(
+            lambda: [lines.process_turnstile_update_message(m) for m in turnstile_messages]
+        ),
+    }
+
+
+def run_render_benchmark(scales, repeat, seed=None):
+    """Times rendering the status page served by `MainHandler` for each multiple of the CTA
+    stations. Every render follows an arrival, so no render is served from the page cache.
+    Larger pages are rendered fewer times. Returns results in milliseconds.
+    """
+    rand = random.Random(seed)
+    results = {}
+    for scale in scales:
+        num_stations = CTA_STATIONS * scale
+        changes, lines = build_models(num_stations, seed)
+        weather = Weather(changes)
+        status_page = StatusPage(MainHandler.template, weather, lines.get_lines(), changes)
+        results[f"render_status_page_{scale}x"] = timed(
+            status_page.get,
+            max(3, repeat // scale),
+            lambda: arrive(lines, rand, rand.randrange(num_stations)),
+        )
+    return results
+
+
+def parse_args(args=None):
+    """Parses the benchmark command line arguments"""
+    parser = argparse.ArgumentParser(description="Benchmarks the state API serialization")
+    parser.add_argument("--scale", type=int, default=10, help="multiple of the CTA stations")
+    parser.add_argument("--repeat", type=int, default=50, help="timed runs of each case")
+    parser.add_argument(
+        "--changed", type=float, default=0.01,
+        help="fraction of the stations changed between incremental snapshots"
+    )
+    parser.add_argument(
+        "--budget-ms", type=float, default=50.0,
+        help="highest accepted median of the cold snapshot"
+    )
+    parser.add_argument(
+        "--history", type=int, nargs="+", default=[1, 10, 100],
+        help="arrivals per station in the replayed histories compared with checkpoint restores"
+    )
+    parser.add_argument(
+        "--messages", type=int, default=20000,
+        help="messages of each kind decoded by the Lines handlers"
+    )
+    parser.add_argument(
+        "--render-scales", type=int, nargs="+", default=[1, 10, 100],
+        help="multiples of the CTA stations shown on the rendered status page"
+    )
+    parser.add_argument("--seed", type=int, default=1, help="seed of the simulated updates")
+    parser.add_argument("--output", help="file the results are written to as JSON")
+    parser.add_argument(
+        "--baseline", default=str(DEFAULT_BASELINE),
+        help="JSON results to compare with, an empty value skips the comparison"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.5,
+        help="fraction by which a result may be worse than its baseline"
+    )
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    logging.getLogger("checkpoint").setLevel(logging.WARNING)
+    arguments = parse_args()
+    logger.info("benchmarking %s times the CTA stations", arguments.scale)
+    stations, timings = run_benchmark(
+        arguments.scale, arguments.repeat, arguments.changed, arguments.seed
+    )
+    timings.update(run_restart_benchmark(
+        arguments.scale, arguments.repeat, arguments.history, arguments.seed
+    )[1])
+    timings.update(run_render_benchmark(
+        arguments.render_scales, arguments.repeat, arguments.seed
+    ))
+    results = {}
+    for case, durations in timings.items():
+        logger.info(
+            "%s: median %.2f ms, max %.2f ms",
+            case,
+            statistics.median(durations),
+            max(durations),
+        )
+        results[f"{case}_ms"] = {
+            "value": statistics.median(durations), "unit": "ms", "higher_is_better": False
+        }
+    rates = run_decode_benchmark(arguments.scale, arguments.messages, arguments.seed)
+    for case, rate in rates.items():
+        logger.info("%s: %.0f per second", case, rate)
+        results[f"{case}_per_second"] = {
+            "value": rate, "unit": "messages/s", "higher_is_better": True
+        }
+
+    # Results are only comparable for the same stations and parameters
+    workload = {
+        "stations": stations,
+        "repeat": arguments.repeat,
+        "changed": arguments.changed,
+        "messages": arguments.messages,
+        "seed": arguments.seed,
+    }
+    if arguments.output:
+        write_results(arguments.output, workload, results)
+
+    failed = False
+    cold_median = statistics.median(timings["cold_snapshot"])
+    if cold_median > arguments.budget_ms:
+        logger.error(
+            "cold snapshot median %.2f ms is over the %.2f ms budget",
+            cold_median,
+            arguments.budget_ms,
+        )
+        failed = True
+    if check_baseline(arguments.baseline, workload, results, arguments.tolerance):
+        failed = True
+    if failed:
+        sys.exit(1)
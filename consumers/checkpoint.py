@@ -0,0 +1,108 @@
+"""Checkpoints the consumer models so the server can restart without replaying topics"""
+import gzip
+import json
+import logging
+import os
+import time
+
+from tornado.ioloop import PeriodicCallback
+
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the checkpoint content changes, older checkpoints are then ignored
+FORMAT_VERSION = 3
+
+
+class Checkpointer:
+    """Saves the model state with the offsets of the messages applied to it.
+
+    Checkpoints are taken on the IOLoop, where the consumers apply their messages, so the
+    saved offsets match the saved state. Batches polled but not yet applied are read again
+    after a restart.
+    """
+
+    def __init__(self, path, changes, lines, weather, consumers, interval_ms=30000):
+        self.path = path
+        self.changes = changes
+        self.lines = lines
+        self.weather = weather
+        self.consumers = consumers
+        self.saved_version = None
+        self._save_callback = PeriodicCallback(self.save, interval_ms)
+
+    def start(self):
+        """Starts saving checkpoints. Call from the IOLoop thread."""
+        self._save_callback.start()
+
+    def stop(self):
+        """Stops saving checkpoints and saves the latest state"""
+        self._save_callback.stop()
+        self.save()
+
+    def to_state(self):
+        """Returns the checkpoint content"""
+        return {
+            "format_version": FORMAT_VERSION,
+            "saved_at": time.time(),
+            "lines": self.lines.to_state(),
+            "weather": self.weather.to_dict(),
+            "offsets": {
+                consumer.topic_name_pattern: consumer.applied_offsets
+                for consumer in self.consumers
+            },
+        }
+
+    def save(self):
+        """Writes a checkpoint if the models changed since the last one"""
+        version = self.changes.version
+        if version == self.saved_version:
+            return
+        start = time.perf_counter()
+        temp_path = f"{self.path}.tmp"
+        try:
+            with gzip.open(temp_path, "wt", compresslevel=1) as checkpoint_file:
+                json.dump(self.to_state(), checkpoint_file, separators=(",", ":"))
+            os.replace(temp_path, self.path)
+        except OSError as exception:
+            logger.error("unable to save checkpoint to %s: %s", self.path, exception)
+            return
+        self.saved_version = version
+        logger.debug(
+            "saved checkpoint to %s in %.1f ms", self.path, (time.perf_counter() - start) * 1000
+        )
+
+    def restore(self):
+        """Restores the models from the checkpoint and has the consumers resume from its
+        offsets. Returns False, leaving the models untouched, if there is no usable checkpoint.
+        """
+        try:
+            with gzip.open(self.path, "rt") as checkpoint_file:
+                state = json.load(checkpoint_file)
+        except FileNotFoundError:
+            logger.info("no checkpoint at %s, replaying topics", self.path)
+            return False
+        except (OSError, ValueError) as exception:
+            logger.error("unable to read checkpoint %s, replaying topics: %s", self.path, exception)
+            return False
+        if state.get("format_version") != FORMAT_VERSION:
+            logger.warning("ignoring checkpoint %s of another format version", self.path)
+            return False
+
+        self.lines.restore(state["lines"])
+        self.weather.restore(state["weather"])
+        offsets = state["offsets"]
+        for consumer in self.consumers:
+            saved_offsets = offsets.get(consumer.topic_name_pattern, {})
+            # JSON object keys are strings, partitions are ints
+            consumer.start_offsets = {
+                int(partition): offset for partition, offset in saved_offsets.items()
+            }
+            consumer.applied_offsets = dict(consumer.start_offsets)
+        self.saved_version = self.changes.version
+        logger.info(
+            "restored checkpoint %s saved %.0f seconds ago",
+            self.path,
+            time.time() - state["saved_at"],
+        )
+        return True
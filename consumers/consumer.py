@@ -1,15 +1,30 @@
 """Defines core consumer functionality"""
 import logging
 import os
+import queue
+import threading
+import time
 
-from confluent_kafka import Consumer, OFFSET_BEGINNING
-from confluent_kafka.avro import AvroConsumer
+from confluent_kafka import Consumer, OFFSET_BEGINNING, TopicPartition
+from confluent_kafka.avro import CachedSchemaRegistryClient
+from confluent_kafka.avro.serializer import SerializerError
+from confluent_kafka.avro.serializer.message_serializer import MessageSerializer
 from tornado import gen
+from tornado.ioloop import PeriodicCallback
 from dotenv import load_dotenv, find_dotenv
 
+from common import metrics
+
 logger = logging.getLogger(__name__)
 load_dotenv(find_dotenv())
 
+MESSAGES = metrics.Counter(
+    "consumer_messages_total", "Messages applied to the models", ("topic",)
+)
+HANDLER_SECONDS = metrics.Histogram(
+    "consumer_handler_seconds", "Time spent applying a batch of messages", ("topic",)
+)
+
 
 class KafkaConsumer:
     """Defines the base kafka consumer class"""
@@ -22,13 +37,32 @@ class KafkaConsumer:
         offset_earliest=False,
         sleep_secs=1.0,
         consume_timeout=0.1,
+        batch_size=500,
+        batch_message_handler=None,
+        min_sleep_secs=0.01,
     ):
-        """Creates a consumer object for asynchronous use"""
+        """Creates a consumer object for asynchronous use.
+
+        Messages are consumed in batches of up to `batch_size`. When `batch_message_handler` is
+        given it receives every batch as a list, otherwise `message_handler` is called once per
+        message. Between batches the consumer sleeps from `min_sleep_secs`, while the topic is
+        busy, up to `sleep_secs`, once it is idle.
+        """
         self.topic_name_pattern = topic_name_pattern
         self.message_handler = message_handler
+        self.batch_message_handler = batch_message_handler
         self.sleep_secs = sleep_secs
+        self.min_sleep_secs = min_sleep_secs
         self.consume_timeout = consume_timeout
+        self.batch_size = batch_size
         self.offset_earliest = offset_earliest
+        # partition -> offset to resume from, restored from a checkpoint
+        self.start_offsets = {}
+        # partition -> offset of the next message to apply, saved in checkpoints
+        self.applied_offsets = {}
+        self.assigned_partitions = []
+        self._messages = MESSAGES.labels(self.topic_name_pattern)
+        self._handler_seconds = HANDLER_SECONDS.labels(self.topic_name_pattern)
 
         self.broker_properties = {
             'bootstrap.servers': os.getenv('KAFKA_URL'),
@@ -37,56 +71,237 @@ class KafkaConsumer:
         if self.offset_earliest:
             self.broker_properties['auto.offset.reset'] = 'earliest'
 
+        # Avro messages are decoded here rather than through AvroConsumer, which only decodes
+        # messages returned by poll() and not batches returned by consume()
+        self.serializer = None
         if is_avro is True:
-            self.broker_properties["schema.registry.url"] = os.getenv('SCHEMA_REGISTRY_URL')
-            self.consumer = AvroConsumer(self.broker_properties)
-        else:
-            self.consumer = Consumer(self.broker_properties)
+            self.serializer = MessageSerializer(
+                CachedSchemaRegistryClient(os.getenv('SCHEMA_REGISTRY_URL'))
+            )
+        self.consumer = Consumer(self.broker_properties)
 
         self.consumer.subscribe([self.topic_name_pattern], on_assign=self.on_assign)
 
     def on_assign(self, consumer, partitions):
-        """Callback for when topic assignment takes place"""
+        """Callback for when topic assignment takes place.
 
-        if self.offset_earliest is False:
-            return
+        Partitions restored from a checkpoint resume from the saved offsets, the others start
+        from the beginning if `offset_earliest` is set.
+        """
         for partition in partitions:
-            partition.offset = OFFSET_BEGINNING
+            start_offset = self.start_offsets.pop(partition.partition, None)
+            if start_offset is not None:
+                partition.offset = start_offset
+            elif self.offset_earliest is True:
+                partition.offset = OFFSET_BEGINNING
 
         logger.info("partitions assigned for %s", self.topic_name_pattern)
         consumer.assign(partitions)
+        self.assigned_partitions = [partition.partition for partition in partitions]
+
+    def lag(self):
+        """Returns partition -> number of messages not applied yet.
+
+        Uses the high watermarks librdkafka cached from its last fetches, so it never waits on
+        the broker. Partitions whose watermark is not known yet are left out.
+        """
+        lags = {}
+        for partition in self.assigned_partitions:
+            low, high = self.consumer.get_watermark_offsets(
+                TopicPartition(self.topic_name_pattern, partition), cached=True
+            )
+            if high < 0:
+                continue
+            lags[partition] = max(high - self.applied_offsets.get(partition, low), 0)
+        return lags
 
     async def consume(self):
         """Asynchronously consumes data from kafka topic"""
+        sleep_secs = self.min_sleep_secs
         while True:
-            num_results = 1
-            while num_results > 0:
-                num_results = self._consume()
-            await gen.sleep(self.sleep_secs)
+            num_results = self._consume()
+            sleep_secs = self.next_sleep(num_results, sleep_secs)
+            # Even a busy topic yields to the event loop between batches
+            await gen.sleep(sleep_secs)
 
-    def _consume(self):
-        """Polls for a message. Returns 1 if a message was received, 0 otherwise"""
-        message = self.consumer.poll(self.consume_timeout)
-        if message is None:
-            logger.info('Not message received from topic %s', self.topic_name_pattern)
+    def next_sleep(self, num_results, sleep_secs):
+        """Returns how long to wait before the next batch given the size of the last one"""
+        if num_results >= self.batch_size:
             return 0
-        if message.error() is not None:
-            logger.error('Error received in message from topic %s',self.topic_name_pattern)
-            return 1
+        if num_results > 0:
+            return self.min_sleep_secs
+        return min(max(sleep_secs, self.min_sleep_secs) * 2, self.sleep_secs)
+
+    def _consume(self):
+        """Consumes a batch of messages. Returns the number of messages received"""
+        batch, num_results = self.poll_batch()
+        self.dispatch(batch)
+        return num_results
+
+    def poll_batch(self):
+        """Consumes and decodes a batch of messages.
+
+        Returns the valid messages and the number of messages received, including invalid ones.
+        """
+        messages = self.consumer.consume(
+            num_messages=self.batch_size, timeout=self.consume_timeout
+        )
+        if not messages:
+            logger.debug('No message received from topic %s', self.topic_name_pattern)
+            return [], 0
+
+        batch = []
+        for message in messages:
+            if message.error() is not None:
+                logger.error(
+                    'Error received in message from topic %s: %s',
+                    self.topic_name_pattern,
+                    message.error()
+                )
+                continue
+            if self._decode(message):
+                batch.append(message)
 
-        logger.info('Received message from topic %s', self.topic_name_pattern)
+        logger.debug('Received %s messages from topic %s', len(batch), self.topic_name_pattern)
+        return batch, len(messages)
+
+    def _decode(self, message):
+        """Decodes Avro message values in place. Returns False if the message is invalid"""
+        if self.serializer is None or message.value() is None:
+            return True
         try:
-            self.message_handler(message)
-        except ValueError as exception:
+            message.set_value(self.serializer.decode_message(message.value(), is_key=False))
+        except SerializerError as exception:
             logger.error(
-                'Unexpected value received in topic %s\n%s',
+                'Unable to decode message from topic %s\n%s',
                 self.topic_name_pattern,
                 exception
             )
+            return False
+        return True
+
+    def dispatch(self, messages):
+        """Hands decoded messages to the message handlers"""
+        if not messages:
+            return
+        start = time.perf_counter()
+        if self.batch_message_handler is not None:
+            try:
+                self.batch_message_handler(messages)
+            except ValueError as exception:
+                self._log_unexpected_value(exception)
+        else:
+            for message in messages:
+                try:
+                    self.message_handler(message)
+                except ValueError as exception:
+                    self._log_unexpected_value(exception)
+        self._handler_seconds.observe(time.perf_counter() - start)
+        self._messages.inc(len(messages))
 
-        return 1
+        applied_offsets = self.applied_offsets
+        for message in messages:
+            applied_offsets[message.partition()] = message.offset() + 1
 
+    def _log_unexpected_value(self, exception):
+        logger.error(
+            'Unexpected value received in topic %s\n%s',
+            self.topic_name_pattern,
+            exception
+        )
 
     def close(self):
         """Cleans up any open kafka consumers"""
         self.consumer.close()
+
+
+class ConsumerRunner:
+    """Polls Kafka consumers from worker threads so the IOLoop never blocks on librdkafka.
+
+    Each consumer gets its own thread that consumes and decodes batches, then hands them to
+    the IOLoop through a bounded queue. When the queue is full the polling threads wait, which
+    applies back-pressure instead of buffering without limit. The IOLoop applies the queued
+    batches to the models, a bounded number of batches per callback.
+    """
+
+    def __init__(self, consumers, max_queue_size=256, apply_interval_ms=20,
+                 max_batches_per_apply=16, profiler=None):
+        """A `profiler` is given the duration of every applied batch, to keep the slowest"""
+        self.consumers = consumers
+        self.profiler = profiler
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.max_batches_per_apply = max_batches_per_apply
+        self.applied_messages = 0
+        self._stop = threading.Event()
+        self._threads = [
+            threading.Thread(
+                target=self._poll,
+                args=(consumer,),
+                name=f"consumer-{consumer.topic_name_pattern}",
+                daemon=True,
+            )
+            for consumer in consumers
+        ]
+        self._apply_callback = PeriodicCallback(self._apply, apply_interval_ms)
+
+    @property
+    def queue_depth(self):
+        """Number of batches waiting to be applied on the IOLoop"""
+        return self.queue.qsize()
+
+    def start(self):
+        """Starts the polling threads and the IOLoop callback. Call from the IOLoop thread."""
+        for thread in self._threads:
+            thread.start()
+        self._apply_callback.start()
+
+    def stop(self):
+        """Stops polling and closes the consumers"""
+        self._stop.set()
+        self._apply_callback.stop()
+        for thread in self._threads:
+            thread.join()
+        for consumer in self.consumers:
+            consumer.close()
+
+    def _poll(self, consumer):
+        """Polling thread loop for a single consumer"""
+        sleep_secs = consumer.min_sleep_secs
+        while not self._stop.is_set():
+            batch, num_results = consumer.poll_batch()
+            if batch:
+                self._put(consumer, batch)
+            sleep_secs = consumer.next_sleep(num_results, sleep_secs)
+            if sleep_secs > 0:
+                self._stop.wait(sleep_secs)
+
+    def _put(self, consumer, batch):
+        while not self._stop.is_set():
+            try:
+                self.queue.put((consumer, batch), timeout=0.5)
+                return
+            except queue.Full:
+                logger.warning(
+                    'consumer queue is full (%s batches), %s is waiting',
+                    self.queue.maxsize,
+                    consumer.topic_name_pattern
+                )
+
+    def _apply(self):
+        """Applies queued batches to the models on the IOLoop"""
+        for _ in range(self.max_batches_per_apply):
+            try:
+                consumer, batch = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            consumer.dispatch(batch)
+            self.applied_messages += len(batch)
+            if self.profiler is not None:
+                self.profiler.record(
+                    time.perf_counter() - start,
+                    "%s batch of %s messages",
+                    consumer.topic_name_pattern,
+                    len(batch),
+                )
+        logger.debug('%s batches still queued after apply', self.queue_depth)
@@ -38,15 +38,21 @@ station_topic = app.topic(
     key_type=None,
     value_type=Station
 )
+# The table changelog is the output topic. It is compacted, so reading it from the start
+# returns about one record per station instead of every update.
 transformed_station_topic = app.topic(
     'com.udacity.project.chicago_transportation.station.transformed',
+    key_type=int,
     value_type=TransformedStation,
-    partitions=1
+    key_serializer='json',
+    partitions=1,
+    compacting=True,
 )
 
 table = app.Table(
     'stations',
-    default=TransformedStation,
+    key_type=int,
+    value_type=TransformedStation,
     partitions=1,
     changelog_topic=transformed_station_topic,
 )
@@ -60,7 +66,11 @@ async def transform_stations(stations):
             order=station.order,
             line=get_station_color(station)
         )
-        table['station_id'] = transformed
+        # Every write to the table is a changelog record, so unchanged stations are skipped
+        current = table.get(station.station_id)
+        if current == transformed:
+            continue
+        table[station.station_id] = transformed
 
 def get_station_color(station: Station):
     if station.red:
@@ -15,24 +15,40 @@ load_dotenv(find_dotenv())
 
 KSQL_URL = os.getenv('KSQL_URL')
 
-KSQL_STATEMENT = """
-CREATE TABLE turnstile
+# Length of the turnstile summary windows. The server sizes its rolling counters from the
+# window bounds in the summary, so changing it needs no other configuration.
+TURNSTILE_WINDOW_MINUTES = int(os.getenv('TURNSTILE_WINDOW_MINUTES', '5'))
+
+KSQL_STATEMENT = f"""
+CREATE STREAM turnstile
   (station_id INT,
    station_name VARCHAR,
-   line VARCHAR
+   line VARCHAR,
+   num_entries INT
   )
   WITH (KAFKA_TOPIC='com.udacity.project.chicago_transportation.station.turstile_entries',
-        KEY='station_id',
         VALUE_FORMAT='AVRO'
   );
 
 CREATE TABLE turnstile_summary
   WITH (VALUE_FORMAT='JSON') AS
-    SELECT station_id, COUNT(station_id) AS count
+    SELECT station_id,
+           SUM(num_entries) AS count,
+           WINDOWSTART() AS window_start,
+           WINDOWEND() AS window_end
     FROM turnstile
+    WINDOW TUMBLING (SIZE {TURNSTILE_WINDOW_MINUTES} MINUTES)
     GROUP BY station_id;
 """
 
+# Updates to a window are cached by Kafka Streams and only emitted on commit, so a window
+# receiving many turnstile events emits a few changelog records
+STREAMS_PROPERTIES = {
+    "ksql.streams.auto.offset.reset": "earliest",
+    "ksql.streams.commit.interval.ms": 5000,
+    "ksql.streams.cache.max.bytes.buffering": 10 * 1024 * 1024,
+}
+
 
 def execute_statement():
     """Executes the KSQL statement against the KSQL API"""
@@ -48,7 +64,7 @@ def execute_statement():
         data=json.dumps(
             {
                 "ksql": KSQL_STATEMENT,
-                "streamsProperties": {"ksql.streams.auto.offset.reset": "earliest"},
+                "streamsProperties": STREAMS_PROPERTIES,
             }
         ),
     )
@@ -0,0 +1,98 @@
+"""Pushes model changes to status page clients over WebSockets"""
+import logging
+
+from tornado.ioloop import PeriodicCallback
+import tornado.websocket
+
+
+logger = logging.getLogger(__name__)
+
+
+class LiveUpdates:
+    """Sends the changes of every flush interval to the connected clients.
+
+    Changes are coalesced per station, so a client receives the latest state of each station
+    changed since the previous flush rather than every update. Deltas and snapshots come from
+    the `StateSerializer` shared with the JSON API, so each is serialized once for all
+    clients. A client with `max_pending_messages` unsent messages skips the following deltas
+    and is sent a snapshot once its writes have drained.
+    """
+
+    def __init__(self, state, flush_interval_ms=1000, max_pending_messages=8):
+        self.state = state
+        self.max_pending_messages = max_pending_messages
+        self.clients = set()
+        self.version = state.changes.version
+        self._flush_callback = PeriodicCallback(self.flush, flush_interval_ms)
+
+    def start(self):
+        """Starts flushing changes. Call from the IOLoop thread."""
+        self._flush_callback.start()
+
+    def stop(self):
+        """Stops flushing changes"""
+        self._flush_callback.stop()
+
+    def add(self, client):
+        """Registers a client, sending it a snapshot of the models"""
+        self.clients.add(client)
+        client.send(self.state.snapshot())
+
+    def remove(self, client):
+        """Unregisters a client"""
+        self.clients.discard(client)
+
+    def flush(self):
+        """Sends the changes made since the last flush to the clients"""
+        version = self.state.changes.version
+        if version == self.version:
+            return
+        delta = self.state.delta(self.version)
+        self.version = version
+
+        snapshot = None
+        for client in list(self.clients):
+            if client.needs_snapshot:
+                if client.pending_messages == 0:
+                    snapshot = snapshot or self.state.snapshot()
+                    client.needs_snapshot = False
+                    client.send(snapshot)
+            elif client.pending_messages >= self.max_pending_messages:
+                logger.debug("live updates client %s is falling behind", client.request.remote_ip)
+                client.needs_snapshot = True
+            else:
+                client.send(delta)
+
+
+class LiveUpdatesHandler(tornado.websocket.WebSocketHandler):
+    """WebSocket connection of a status page receiving live updates"""
+
+    def initialize(self, live_updates):
+        """Initializes the handler with required configuration"""
+        self.live_updates = live_updates
+        self.pending_messages = 0
+        self.needs_snapshot = False
+
+    def open(self):
+        self.live_updates.add(self)
+
+    def on_close(self):
+        self.live_updates.remove(self)
+
+    def on_message(self, message):
+        """Clients only listen, messages from them are ignored"""
+
+    def send(self, message):
+        """Writes a message, keeping count of the messages not yet flushed to the socket"""
+        try:
+            future = self.write_message(message)
+        except tornado.websocket.WebSocketClosedError:
+            self.live_updates.remove(self)
+            return
+        self.pending_messages += 1
+        future.add_done_callback(self._on_sent)
+
+    def _on_sent(self, future):
+        self.pending_messages -= 1
+        if future.exception() is not None:
+            self.live_updates.remove(self)
@@ -1,3 +1,5 @@
+from .change_tracker import ChangeTracker
+from .rolling_counter import RollingCounter
 from .station import Station
 from .line import Line
 from .lines import Lines
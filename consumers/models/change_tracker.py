@@ -0,0 +1,40 @@
+"""Tracks changes to the consumer models"""
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeTracker:
+    """Version counter bumped by the model handlers whenever the displayed state changes.
+
+    Handlers that change a station or the weather record the changed item, keeping only the
+    version of its latest change. This way every change since any version can be listed
+    without keeping a log of the updates.
+    """
+
+    def __init__(self):
+        """Creates the tracker at version 0"""
+        self.version = 0
+        # (kind, key) -> (version of the latest change, item)
+        self._changed = {}
+
+    def record(self, kind, key, item):
+        """Marks an item as changed. The item must provide `to_dict()`."""
+        self.version += 1
+        self._changed[(kind, key)] = (self.version, item)
+
+    def changed_items(self, version):
+        """Yields (kind, key, version of the latest change, item) for items changed after
+        `version`
+        """
+        for (kind, key), (changed_version, item) in self._changed.items():
+            if changed_version > version:
+                yield kind, key, changed_version, item
+
+    def changes_since(self, version):
+        """Returns the current state of the items changed after `version`, grouped by kind"""
+        changes = {}
+        for kind, _, _, item in self.changed_items(version):
+            changes.setdefault(kind, []).append(item.to_dict())
+        return changes
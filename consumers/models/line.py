@@ -1,8 +1,7 @@
 """Contains functionality related to Lines"""
-import json
 import logging
 
-from models import Station
+from models import ChangeTracker, Station
 
 
 logger = logging.getLogger(__name__)
@@ -11,9 +10,10 @@ logger = logging.getLogger(__name__)
 class Line:
     """Defines the Line Model"""
 
-    def __init__(self, color):
+    def __init__(self, color, changes=None):
         """Creates a line"""
         self.color = color
+        self.changes = changes if changes is not None else ChangeTracker()
         self.color_code = "0xFFFFFF"
         if self.color == "blue":
             self.color_code = "#1E90FF"
@@ -22,22 +22,35 @@ class Line:
         elif self.color == "green":
             self.color_code = "#32CD32"
         self.stations = {}
+        # Stations sorted by their order on the line, maintained as stations are added
+        self.ordered_stations = []
 
-    def _handle_station(self, value):
-        """Adds the station to this Line's data model"""
+    def handle_station(self, value):
+        """Adds the station to this Line's data model. Returns the station, or None if it
+        belongs to another line
+        """
         if value["line"] != self.color:
-            return
-        self.stations[value["station_id"]] = Station.from_message(value)
+            return None
+        station = Station.from_message(value)
+        self.add_stations([station])
+        return station
+
+    def add_stations(self, stations):
+        """Adds stations to this Line, replacing the ones with the same ids"""
+        for station in stations:
+            self.stations[station.station_id] = station
+            self.changes.record("stations", station.station_id, station)
+        self.ordered_stations = sorted(self.stations.values(), key=lambda x: x.order)
 
-    def _handle_arrival(self, message):
+    def handle_arrival(self, value):
         """Updates train locations"""
-        value = message.value()
         prev_station_id = value.get("prev_station_id")
         prev_dir = value.get("prev_direction")
         if prev_dir is not None and prev_station_id is not None:
             prev_station = self.stations.get(prev_station_id)
             if prev_station is not None:
                 prev_station.handle_departure(prev_dir)
+                self.changes.record("stations", prev_station_id, prev_station)
             else:
                 logger.debug("unable to handle previous station due to missing station")
         else:
@@ -53,23 +66,30 @@ class Line:
         station.handle_arrival(
             value.get("direction"), value.get("train_id"), value.get("train_status")
         )
+        self.changes.record("stations", station_id, station)
 
-    def process_new_arrival_message(self, message):
-        self._handle_arrival(message)
+    def handle_turnstile_update(self, station, value):
+        """Updates the turnstile entries of one of this Line's stations"""
+        station.process_message(value)
+        self.changes.record("stations", station.station_id, station)
 
-    def process_station_update_message(self, message):
-        try:
-            value = json.loads(message.value())
-            self._handle_station(value)
-        except json.decoder.JSONDecodeError as exception:
-            logger.fatal("bad station? %s, %s", value, exception)
-
-    def process_turnstile_update_message(self, message):
-        json_data = json.loads(message.value())
-        logger.info('Data from turnstile_summary %s', message.value())
-        station_id = json_data.get("STATION_ID")
-        station = self.stations.get(station_id)
-        if station is None:
-            logger.debug("unable to handle message due to missing station")
-            return
-        station.process_message(json_data)
+    def process_arrival_batch_message(self, message):
+        """Unpacks a batch of arrivals, applying them in the order they happened"""
+        value = message.value()
+        arrivals = zip(
+            value["station_ids"],
+            value["train_ids"],
+            value["directions"],
+            value["train_statuses"],
+            value["prev_station_ids"],
+            value["prev_directions"],
+        )
+        for station_id, train_id, direction, status, prev_station_id, prev_direction in arrivals:
+            self.handle_arrival({
+                "station_id": station_id,
+                "train_id": train_id,
+                "direction": direction,
+                "train_status": status,
+                "prev_station_id": prev_station_id,
+                "prev_direction": prev_direction,
+            })
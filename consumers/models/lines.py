@@ -2,7 +2,7 @@
 import json
 import logging
 
-from models import Line
+from models import ChangeTracker, Line, Station
 
 
 logger = logging.getLogger(__name__)
@@ -11,29 +11,105 @@ logger = logging.getLogger(__name__)
 class Lines:
     """Contains all train lines"""
 
-    def __init__(self):
+    colors = ("red", "green", "blue")
+
+    def __init__(self, changes=None):
         """Creates the Lines object"""
-        self._lines = [Line('red'), Line('green'), Line('blue')]
+        self.changes = changes if changes is not None else ChangeTracker()
+        self._lines = {color: Line(color, self.changes) for color in Lines.colors}
+        # station_id -> (Line, Station), so updates go straight to the owning station
+        self._stations = {}
+        # Start of the newest turnstile summary window
+        self._latest_window_ms = None
 
     def process_new_arrival_message(self, message):
         value = message.value()
-        line = self._get_station_by_color(value['line'])
-        line.process_new_arrival_message(message)
+        self._get_line_by_color(value['line']).handle_arrival(value)
+
+    def process_new_arrival_messages(self, messages):
+        """Applies a batch of arrivals in the order they were produced"""
+        for message in messages:
+            try:
+                self.process_new_arrival_message(message)
+            except ValueError as exception:
+                logger.error('Unable to process arrival: %s', exception)
+
+    def process_arrival_batch_message(self, message):
+        value = message.value()
+        line = self._get_line_by_color(value['line'])
+        line.process_arrival_batch_message(message)
 
     def process_station_update_message(self, message):
-        value = json.loads(message.value())
-        line = self._get_station_by_color(value['line'])
-        line.process_station_update_message(message)
+        try:
+            value = json.loads(message.value())
+        except json.decoder.JSONDecodeError as exception:
+            raise ValueError(f'Invalid station update {message.value()}') from exception
+        line = self._get_line_by_color(value['line'])
+        station = line.handle_station(value)
+        self._stations[station.station_id] = (line, station)
 
     def process_turnstile_update_message(self, message):
-        for line in self._lines:
-            line.process_turnstile_update_message(message)
+        value = json.loads(message.value())
+        logger.debug('Data from turnstile_summary %s', value)
+        entry = self._stations.get(value.get("STATION_ID"))
+        if entry is None:
+            logger.debug("unable to handle turnstile update due to missing station")
+            return
+        line, station = entry
+        line.handle_turnstile_update(station, value)
+
+        window_start = value.get("WINDOW_START")
+        if window_start is not None and (
+                self._latest_window_ms is None or window_start > self._latest_window_ms):
+            self._latest_window_ms = window_start
+            self._expire_recent_entries(window_start)
+
+    def _expire_recent_entries(self, now_ms):
+        """Moves the rolling entry counts of every station to the newest window, so stations
+        without new entries stop counting the old ones
+        """
+        for station_id, (_, station) in self._stations.items():
+            if station.expire_recent_entries(now_ms):
+                self.changes.record("stations", station_id, station)
+
+    def process_turnstile_update_messages(self, messages):
+        """Applies a batch of turnstile summary updates.
+
+        The summary is a changelog keyed by station and window, so only the latest update of
+        each station and window in the batch needs to be applied.
+        """
+        latest = {}
+        for index, message in enumerate(messages):
+            key = message.key()
+            latest[index if key is None else key] = message
+        for message in latest.values():
+            self.process_turnstile_update_message(message)
+
+    def to_state(self):
+        """Returns the state of every line, for checkpoints"""
+        return {
+            "lines": {
+                color: [station.to_state() for station in line.ordered_stations]
+                for color, line in self._lines.items()
+            },
+            "latest_window_ms": self._latest_window_ms,
+        }
+
+    def restore(self, state):
+        """Restores the stations of the state returned by `to_state`"""
+        for color, station_states in state["lines"].items():
+            line = self._get_line_by_color(color)
+            stations = [Station.from_state(station_state) for station_state in station_states]
+            line.add_stations(stations)
+            for station in stations:
+                self._stations[station.station_id] = (line, station)
+        self._latest_window_ms = state["latest_window_ms"]
 
-    def _get_station_by_color(self, color: str):
+    def _get_line_by_color(self, color: str):
         try:
-            return next((line for line in self._lines if line.color == color))
-        except StopIteration as exception:
+            return self._lines[color]
+        except KeyError as exception:
             raise ValueError(f'Not existing line with color {color}') from exception
 
     def get_lines(self):
-        return self._lines
+        return list(self._lines.values())
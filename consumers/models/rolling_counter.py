@@ -0,0 +1,92 @@
+"""Counts events over a sliding period"""
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class RollingCounter:
+    """Keeps the number of events in the latest `period_ms` of event time.
+
+    Counts are kept in a ring of buckets of `bucket_ms` each, with a running total, so reading
+    the count takes constant time. When the buckets match the windows of an upstream windowed
+    aggregate, `set_window` takes the latest running count of a window instead of increments.
+    Time only moves forward with the events. Events older than the period are ignored.
+    """
+
+    __slots__ = ("bucket_ms", "total", "_buckets", "_latest_bucket")
+
+    def __init__(self, period_ms, bucket_ms):
+        """Creates an empty counter"""
+        self.bucket_ms = bucket_ms
+        self.total = 0
+        self._buckets = [0] * max(1, period_ms // bucket_ms)
+        # Index of the newest bucket since the epoch
+        self._latest_bucket = None
+
+    @classmethod
+    def from_state(cls, state):
+        """Creates a counter from the state returned by `to_state`"""
+        counter = cls(len(state["buckets"]) * state["bucket_ms"], state["bucket_ms"])
+        counter._buckets = list(state["buckets"])
+        counter._latest_bucket = state["latest_bucket"]
+        counter.total = sum(counter._buckets)
+        return counter
+
+    def to_state(self):
+        """Returns the state of the counter, for checkpoints"""
+        return {
+            "bucket_ms": self.bucket_ms,
+            "buckets": self._buckets,
+            "latest_bucket": self._latest_bucket,
+        }
+
+    @property
+    def period_ms(self):
+        """Length of the counted period"""
+        return len(self._buckets) * self.bucket_ms
+
+    def add(self, timestamp_ms, count=1):
+        """Counts events that happened at the given time"""
+        index = self._bucket_index(timestamp_ms)
+        if index is None:
+            return
+        self._buckets[index] += count
+        self.total += count
+
+    def advance(self, timestamp_ms):
+        """Moves time forward to the timestamp without counting events"""
+        self._bucket_index(timestamp_ms)
+
+    def set_window(self, window_start_ms, count):
+        """Sets the running count of the window starting at the given time.
+
+        Returns the increase since the previous count of the window, or 0 if the window is
+        older than the period.
+        """
+        index = self._bucket_index(window_start_ms)
+        if index is None:
+            return 0
+        delta = count - self._buckets[index]
+        self._buckets[index] = count
+        self.total += delta
+        return delta
+
+    def _bucket_index(self, timestamp_ms):
+        """Moves time forward to the timestamp and returns the index of its bucket in the ring,
+        or None if it is older than the period
+        """
+        bucket = timestamp_ms // self.bucket_ms
+        num_buckets = len(self._buckets)
+        if self._latest_bucket is None or bucket > self._latest_bucket:
+            # Buckets that fell out of the period are cleared before being reused
+            first_cleared = bucket - num_buckets + 1
+            if self._latest_bucket is not None:
+                first_cleared = max(first_cleared, self._latest_bucket + 1)
+            for expired in range(first_cleared, bucket + 1):
+                self.total -= self._buckets[expired % num_buckets]
+                self._buckets[expired % num_buckets] = 0
+            self._latest_bucket = bucket
+        elif bucket <= self._latest_bucket - num_buckets:
+            return None
+        return bucket % num_buckets
@@ -1,43 +1,212 @@
 """Contains functionality related to Stations"""
+from enum import IntEnum
+import heapq
 import json
 import logging
+import sys
+
+from models import RollingCounter
 
 
 logger = logging.getLogger(__name__)
 
+# Mirrors the train statuses of the producer
+TrainStatus = IntEnum("TrainStatus", "out_of_service in_service broken_down", start=0)
+STATUS_LABELS = tuple(status.name.replace("_", " ") for status in TrainStatus)
+
 
 class Station:
-    """Defines the Station Model"""
+    """Defines the Station Model.
+
+    Stations are slotted and keep the train in each direction as an interned train id and a
+    status enum, so arrivals do not allocate. `dir_a` and `dir_b` are dict views built on
+    read.
+
+    Turnstile entries come from windowed summaries. The entries of the latest
+    `rolling_period_ms` are kept in a rolling counter, and the total adds up the increases of
+    every window. The latest count of each window is kept for the total until the window can
+    no longer be updated, so late updates of windows older than the rolling period still count
+    once. Updates of forgotten windows are ignored.
+    """
 
-    def __init__(self, station_id, station_name, order):
+    rolling_period_ms = 60 * 60 * 1000
+    # Windows of the KSQL turnstile summary take updates until a day after their end, the
+    # default grace period
+    window_grace_ms = 24 * 60 * 60 * 1000
+
+    __slots__ = (
+        "station_id",
+        "station_name",
+        "order",
+        "line",
+        "train_a",
+        "status_a",
+        "train_b",
+        "status_b",
+        "num_turnstile_entries",
+        "recent_entries",
+        "window_counts",
+        "window_starts",
+        "forgotten_window_start",
+    )
+
+    def __init__(self, station_id, station_name, order, line=None):
         """Creates a Station Model"""
         self.station_id = station_id
         self.station_name = station_name
         self.order = order
-        self.dir_a = None
-        self.dir_b = None
+        self.line = line
+        self.train_a = None
+        self.status_a = None
+        self.train_b = None
+        self.status_b = None
         self.num_turnstile_entries = 0
+        # Created from the first windowed summary, with buckets matching its windows
+        self.recent_entries = None
+        # Window start -> latest count of the window, with a min-heap of the starts to forget
+        # the oldest windows first
+        self.window_counts = {}
+        self.window_starts = []
+        # Start of the newest forgotten window, updates of windows up to it are ignored
+        self.forgotten_window_start = None
 
     @classmethod
     def from_message(cls, value):
         """Given a Kafka Station message, creates and returns a station"""
-        return Station(value["station_id"], value["station_name"], value["order"])
+        return Station(
+            value["station_id"], value["station_name"], value["order"], value.get("line")
+        )
+
+    @classmethod
+    def from_state(cls, state):
+        """Creates a station from the state returned by `to_state`"""
+        station = Station(state["station_id"], state["station_name"], state["order"], state["line"])
+        station.train_a, station.train_b = state["train_a"], state["train_b"]
+        if station.train_a is not None:
+            station.train_a = sys.intern(station.train_a)
+            station.status_a = TrainStatus(state["status_a"])
+        if station.train_b is not None:
+            station.train_b = sys.intern(station.train_b)
+            station.status_b = TrainStatus(state["status_b"])
+        station.num_turnstile_entries = state["num_turnstile_entries"]
+        if state["recent_entries"] is not None:
+            station.recent_entries = RollingCounter.from_state(state["recent_entries"])
+        station.window_counts = dict(state["window_counts"])
+        station.window_starts = list(station.window_counts)
+        heapq.heapify(station.window_starts)
+        station.forgotten_window_start = state["forgotten_window_start"]
+        return station
+
+    def to_state(self):
+        """Returns the complete state of the station, for checkpoints"""
+        return {
+            "station_id": self.station_id,
+            "station_name": self.station_name,
+            "order": self.order,
+            "line": self.line,
+            "train_a": self.train_a,
+            "status_a": self.status_a,
+            "train_b": self.train_b,
+            "status_b": self.status_b,
+            "num_turnstile_entries": self.num_turnstile_entries,
+            "recent_entries": (
+                None if self.recent_entries is None else self.recent_entries.to_state()
+            ),
+            # JSON object keys are strings, so windows are kept as [start, count] pairs
+            "window_counts": list(self.window_counts.items()),
+            "forgotten_window_start": self.forgotten_window_start,
+        }
+
+    @property
+    def dir_a(self):
+        """Train in direction a with its status, or None"""
+        return Station._direction_view(self.train_a, self.status_a)
+
+    @property
+    def dir_b(self):
+        """Train in direction b with its status, or None"""
+        return Station._direction_view(self.train_b, self.status_b)
+
+    @staticmethod
+    def _direction_view(train_id, status):
+        if train_id is None:
+            return None
+        return {"train_id": train_id, "status": STATUS_LABELS[status]}
 
     def handle_departure(self, direction):
         """Removes a train from the station"""
         if direction == "a":
-            self.dir_a = None
+            self.train_a = None
+            self.status_a = None
         else:
-            self.dir_b = None
+            self.train_b = None
+            self.status_b = None
 
     def handle_arrival(self, direction, train_id, train_status):
         """Unpacks arrival data"""
-        status_dict = {"train_id": train_id, "status": train_status.replace("_", " ")}
+        status = TrainStatus.__members__.get(train_status)
+        if status is None:
+            raise ValueError(f"Unknown train status {train_status}")
+        train_id = sys.intern(train_id)
         if direction == "a":
-            self.dir_a = status_dict
+            self.train_a = train_id
+            self.status_a = status
         else:
-            self.dir_b = status_dict
+            self.train_b = train_id
+            self.status_b = status
+
+    @property
+    def num_recent_entries(self):
+        """Turnstile entries in the latest rolling period"""
+        return 0 if self.recent_entries is None else self.recent_entries.total
+
+    def expire_recent_entries(self, now_ms):
+        """Drops the entries older than the rolling period. Returns True if any were dropped"""
+        if self.recent_entries is None:
+            return False
+        total = self.recent_entries.total
+        self.recent_entries.advance(now_ms)
+        return self.recent_entries.total != total
 
     def process_message(self, json_data):
-        """Handles arrival and turnstile messages"""
-        self.num_turnstile_entries = json_data["COUNT"]
+        """Handles turnstile summary messages"""
+        window_start = json_data.get("WINDOW_START")
+        if window_start is None:
+            self.num_turnstile_entries = json_data["COUNT"]
+            return
+        if self.forgotten_window_start is not None and window_start <= self.forgotten_window_start:
+            logger.debug("ignoring update of forgotten window %s", window_start)
+            return
+        count = json_data["COUNT"]
+        window_ms = json_data["WINDOW_END"] - window_start
+        if self.recent_entries is None:
+            self.recent_entries = RollingCounter(Station.rolling_period_ms, window_ms)
+        self.recent_entries.set_window(window_start, count)
+        previous = self.window_counts.get(window_start)
+        if previous is None:
+            previous = 0
+            heapq.heappush(self.window_starts, window_start)
+        self.num_turnstile_entries += count - previous
+        self.window_counts[window_start] = count
+        # Windows ending a grace period before this one started take no more updates
+        self._forget_windows(window_start - window_ms - Station.window_grace_ms)
+
+    def _forget_windows(self, before_ms):
+        """Drops the counts of the windows starting before the given time"""
+        while self.window_starts and self.window_starts[0] < before_ms:
+            # Starts are popped in increasing order, so the last one is the newest forgotten
+            self.forgotten_window_start = heapq.heappop(self.window_starts)
+            del self.window_counts[self.forgotten_window_start]
+
+    def to_dict(self):
+        """Returns the displayed state of the station"""
+        return {
+            "station_id": self.station_id,
+            "station_name": self.station_name,
+            "line": self.line,
+            "order": self.order,
+            "dir_a": self.dir_a,
+            "dir_b": self.dir_b,
+            "num_turnstile_entries": self.num_turnstile_entries,
+            "num_recent_entries": self.num_recent_entries,
+        }
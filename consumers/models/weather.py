@@ -1,6 +1,8 @@
 """Contains functionality related to Weather"""
 import logging
 
+from models import ChangeTracker
+
 
 logger = logging.getLogger(__name__)
 
@@ -8,8 +10,9 @@ logger = logging.getLogger(__name__)
 class Weather:
     """Defines the Weather model"""
 
-    def __init__(self):
+    def __init__(self, changes=None):
         """Creates the weather model"""
+        self.changes = changes if changes is not None else ChangeTracker()
         self.temperature = 70.0
         self.status = "sunny"
 
@@ -18,3 +21,14 @@ class Weather:
         value = message.value()
         self.temperature = value['temperature']
         self.status = value['status']
+        self.changes.record("weather", None, self)
+
+    def restore(self, state):
+        """Restores the weather returned by `to_dict`"""
+        self.temperature = state["temperature"]
+        self.status = state["status"]
+        self.changes.record("weather", None, self)
+
+    def to_dict(self):
+        """Returns the displayed weather"""
+        return {"temperature": self.temperature, "status": self.status}
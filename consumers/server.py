@@ -1,42 +1,124 @@
 """Defines a Tornado Server that consumes Kafka Event data for display"""
+from collections import namedtuple
+import gzip
 import logging
 import logging.config
+import os
 from pathlib import Path
+import sys
+import time
 
 import tornado.ioloop
 import tornado.template
 import tornado.web
 
 
-# Import logging before models to ensure configuration is picked up
-logging.config.fileConfig(f"{Path(__file__).parents[0]}/logging.ini")
+# Import logging before models to ensure configuration is picked up. Scripts importing the
+# server, such as benchmark.py, keep the loggers they created first.
+logging.config.fileConfig(
+    f"{Path(__file__).parents[0]}/logging.ini", disable_existing_loggers=False
+)
+# Modules shared with the producers live at the repository root
+sys.path.append(str(Path(__file__).parents[1]))
 
 
-from consumer import KafkaConsumer
-from models import Lines, Weather
+from checkpoint import Checkpointer
+from common import metrics
+from common.profiler import Profiler
+from consumer import ConsumerRunner, KafkaConsumer
+from live_updates import LiveUpdates, LiveUpdatesHandler
+from models import ChangeTracker, Lines, Weather
+from state_api import DeltaHandler, SnapshotHandler, StateSerializer
 import topic_check
 
 
 logger = logging.getLogger(__name__)
 
 
+RenderedPage = namedtuple("RenderedPage", ["version", "etag", "html", "gzipped"])
+
+PAGE_RENDER_SECONDS = metrics.Histogram(
+    "server_page_render_seconds", "Time spent rendering and compressing the status page"
+)
+
+
+class StatusPage:
+    """Renders the status page at most once per version of the models"""
+
+    def __init__(self, template, weather, lines, changes):
+        self.template = template
+        self.weather = weather
+        self.lines = lines
+        self.changes = changes
+        # Versions restart with the server, so etags carry the start time as well
+        self._etag_prefix = int(time.time())
+        self._page = None
+        self._render_seconds = PAGE_RENDER_SECONDS.labels()
+
+    def get(self):
+        """Returns the rendered page for the current version, rendering it if needed"""
+        version = self.changes.version
+        if self._page is None or self._page.version != version:
+            logger.debug("rendering status page version %s", version)
+            start = time.perf_counter()
+            html = self.template.generate(weather=self.weather, lines=self.lines)
+            self._page = RenderedPage(
+                version, f'"{self._etag_prefix}-{version}"', html, gzip.compress(html)
+            )
+            self._render_seconds.observe(time.perf_counter() - start)
+        return self._page
+
+
 class MainHandler(tornado.web.RequestHandler):
     """Defines a web request handler class"""
 
     template_dir = tornado.template.Loader(f"{Path(__file__).parents[0]}/templates")
     template = template_dir.load("status.html")
 
-    def initialize(self, weather, lines):
+    def initialize(self, status_page):
         """Initializes the handler with required configuration"""
-        self.weather = weather
-        self.lines = lines
+        self.status_page = status_page
+
+    def compute_etag(self):
+        """Etags are set from the page version instead of hashing the response"""
+        return None
 
     def get(self):
         """Responds to get requests"""
-        logging.debug("rendering and writing handler template")
-        self.write(
-            MainHandler.template.generate(weather=self.weather, lines=self.lines)
-        )
+        page = self.status_page.get()
+        self.set_header("Etag", page.etag)
+        self.set_header("Vary", "Accept-Encoding")
+        if self.check_etag_header():
+            self.set_status(304)
+            return
+
+        if "gzip" in self.request.headers.get("Accept-Encoding", ""):
+            self.set_header("Content-Encoding", "gzip")
+            self.write(page.gzipped)
+        else:
+            self.write(page.html)
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Serves the metrics of the process"""
+
+    def get(self):
+        """Responds with every metric in the Prometheus text format"""
+        self.set_header("Content-Type", metrics.CONTENT_TYPE)
+        self.write(metrics.REGISTRY.render())
+
+
+class ProfiledApplication(tornado.web.Application):
+    """Application handing the duration of every request to the profiler"""
+
+    def __init__(self, handlers, profiler, **settings):
+        super().__init__(handlers, **settings)
+        self.profiler = profiler
+
+    def log_request(self, handler):
+        super().log_request(handler)
+        request = handler.request
+        self.profiler.record(request.request_time(), "%s %s", request.method, request.uri)
 
 
 def run_server():
@@ -52,15 +134,52 @@ def run_server():
         )
         exit(1)
 
-    weather_model = Weather()
-    lines = Lines()
+    changes = ChangeTracker()
+    weather_model = Weather(changes)
+    lines = Lines(changes)
+    status_page = StatusPage(MainHandler.template, weather_model, lines.get_lines(), changes)
+    state = StateSerializer(changes)
+    live_updates = LiveUpdates(state)
+
+    # Samples are only taken once a profiling mode is turned on, by setting or by SIGUSR1
+    profiler = Profiler(
+        os.getenv('SERVER_PROFILE_DIR', 'profiles'),
+        os.getenv('SERVER_PROFILE_FORMAT', 'collapsed'),
+        slowest=int(os.getenv('SERVER_PROFILE_SLOWEST', '0')),
+    )
+    profile_seconds = float(os.getenv('SERVER_PROFILE_SECONDS', '30'))
+    profiler.install_signal_handler(profile_seconds)
+    if os.getenv('SERVER_PROFILE_ON_START', 'false') == 'true':
+        profiler.sample_for(profile_seconds)
+    profiler.start()
 
-    application = tornado.web.Application(
-        [(r"/", MainHandler, {"weather": weather_model, "lines": lines.get_lines()})]
+    application = ProfiledApplication(
+        [
+            (r"/", MainHandler, {"status_page": status_page}),
+            (r"/live", LiveUpdatesHandler, {"live_updates": live_updates}),
+            (r"/api/snapshot", SnapshotHandler, {"state": state}),
+            (r"/api/delta", DeltaHandler, {"state": state}),
+            (r"/metrics", MetricsHandler),
+        ],
+        profiler,
+        websocket_ping_interval=30,
     )
     application.listen(8888)
 
     # Build kafka consumers
+    if os.getenv('ARRIVAL_MODE', 'per_arrival') == 'batched':
+        arrival_consumer = KafkaConsumer(
+            "com.udacity.project.chicago_transportation.arrival.batch",
+            lines.process_arrival_batch_message,
+            offset_earliest=True,
+        )
+    else:
+        arrival_consumer = KafkaConsumer(
+            "com.udacity.project.chicago_transportation.arrival",
+            lines.process_new_arrival_message,
+            offset_earliest=True,
+            batch_message_handler=lines.process_new_arrival_messages,
+        )
     consumers = [
         KafkaConsumer(
             "com.udacity.project.chicago_transportation.weather.update",
@@ -73,32 +192,65 @@ def run_server():
             offset_earliest=True,
             is_avro=False,
         ),
-        KafkaConsumer(
-            "com.udacity.project.chicago_transportation.arrival",
-            lines.process_new_arrival_message,
-            offset_earliest=True,
-        ),
+        arrival_consumer,
         KafkaConsumer(
             "TURNSTILE_SUMMARY",
             lines.process_turnstile_update_message,
             offset_earliest=True,
             is_avro=False,
+            batch_message_handler=lines.process_turnstile_update_messages,
         ),
     ]
 
+    # Resume from the last checkpoint instead of replaying the topics, unless disabled
+    checkpointer = None
+    checkpoint_path = os.getenv('SERVER_CHECKPOINT_PATH', 'checkpoint.json.gz')
+    if checkpoint_path:
+        checkpointer = Checkpointer(checkpoint_path, changes, lines, weather_model, consumers)
+        checkpointer.restore()
+
+    # Kafka polling and decoding happen on worker threads, models are updated on the IOLoop
+    runner = ConsumerRunner(consumers, profiler=profiler)
+    metrics.Collected(
+        "consumer_lag",
+        "Messages of the partition not applied to the models yet",
+        "gauge",
+        ("topic", "partition"),
+        lambda: [
+            ((consumer.topic_name_pattern, partition), lag)
+            for consumer in consumers
+            for partition, lag in consumer.lag().items()
+        ],
+    )
+    metrics.Collected(
+        "consumer_queue_depth",
+        "Batches polled and waiting to be applied on the IOLoop",
+        "gauge",
+        (),
+        lambda: [((), runner.queue_depth)],
+    )
     try:
         logger.info(
             "Open a web browser to http://localhost:8888 to see the Transit Status Page"
         )
-        for consumer in consumers:
-            tornado.ioloop.IOLoop.current().spawn_callback(consumer.consume)
+        runner.start()
+        live_updates.start()
+        if checkpointer is not None:
+            checkpointer.start()
+        tornado.ioloop.PeriodicCallback(
+            lambda: logger.info("consumer queue depth: %s batches", runner.queue_depth),
+            60000,
+        ).start()
 
         tornado.ioloop.IOLoop.current().start()
     except KeyboardInterrupt as e:
         logger.info("shutting down server")
         tornado.ioloop.IOLoop.current().stop()
-        for consumer in consumers:
-            consumer.close()
+        live_updates.stop()
+        runner.stop()
+        if checkpointer is not None:
+            checkpointer.stop()
+        profiler.close()
 
 
 if __name__ == "__main__":
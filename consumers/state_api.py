@@ -0,0 +1,103 @@
+"""Serves the state of the consumer models as JSON"""
+import json
+import logging
+import time
+
+import tornado.web
+
+
+logger = logging.getLogger(__name__)
+
+
+class StateSerializer:
+    """Serializes snapshots and deltas of the models to JSON.
+
+    Every item is serialized once per change and the fragments are reused until it changes
+    again, so a snapshot only serializes the items changed since the previous one. Complete
+    snapshots and deltas are cached for the current version.
+    """
+
+    def __init__(self, changes, max_cached_deltas=64):
+        self.changes = changes
+        self.max_cached_deltas = max_cached_deltas
+        # Versions restart with the server, so clients pass the epoch back with `since`
+        self.epoch = int(time.time())
+        # (kind, key) -> (version of the change, serialized item)
+        self._fragments = {}
+        self._version = None
+        self._snapshot = None
+        self._deltas = {}
+
+    def snapshot(self):
+        """Returns the state of every item as a JSON string"""
+        self._check_version()
+        if self._snapshot is None:
+            self._snapshot = self._serialize("snapshot", None, 0)
+        return self._snapshot
+
+    def delta(self, since, epoch=None):
+        """Returns the items changed after version `since` as a JSON string.
+
+        Falls back to a snapshot when the version or epoch is not one of this server's.
+        """
+        self._check_version()
+        if since < 0 or since > self._version or (epoch is not None and epoch != self.epoch):
+            return self.snapshot()
+        if since not in self._deltas:
+            if len(self._deltas) >= self.max_cached_deltas:
+                self._deltas.clear()
+            self._deltas[since] = self._serialize("delta", since, since)
+        return self._deltas[since]
+
+    def _check_version(self):
+        if self._version != self.changes.version:
+            self._version = self.changes.version
+            self._snapshot = None
+            self._deltas.clear()
+
+    def _serialize(self, message_type, since, version):
+        items = {}
+        for kind, key, changed_version, item in self.changes.changed_items(version):
+            fragment = self._fragments.get((kind, key))
+            if fragment is None or fragment[0] != changed_version:
+                fragment = (changed_version, json.dumps(item.to_dict()))
+                self._fragments[(kind, key)] = fragment
+            items.setdefault(kind, []).append(fragment[1])
+
+        header = {"type": message_type, "epoch": self.epoch, "version": self._version}
+        if since is not None:
+            header["since"] = since
+        parts = [json.dumps(header)[:-1]]
+        parts.extend(f', "{kind}": [{", ".join(fragments)}]' for kind, fragments in items.items())
+        parts.append("}")
+        return "".join(parts)
+
+
+class SnapshotHandler(tornado.web.RequestHandler):
+    """Responds with the state of every station and the weather"""
+
+    def initialize(self, state):
+        """Initializes the handler with required configuration"""
+        self.state = state
+
+    def get(self):
+        self.set_header("Content-Type", "application/json")
+        self.write(self.state.snapshot())
+
+
+class DeltaHandler(tornado.web.RequestHandler):
+    """Responds with the stations and weather changed since the version in `since`"""
+
+    def initialize(self, state):
+        """Initializes the handler with required configuration"""
+        self.state = state
+
+    def get(self):
+        try:
+            since = int(self.get_argument("since"))
+            epoch = self.get_argument("epoch", None)
+            epoch = None if epoch is None else int(epoch)
+        except ValueError as exception:
+            raise tornado.web.HTTPError(400, "since and epoch must be integers") from exception
+        self.set_header("Content-Type", "application/json")
+        self.write(self.state.delta(since, epoch))
@@ -0,0 +1,173 @@
+"""Benchmarks the producer hot paths without Kafka: simulation ticks, train line ticks,
+turnstile entries and event serialization.
+
+Events are produced to the null sink, see `models/sinks.py`. Run with `python benchmark.py`.
+Results can be written as JSON with `--output` and are compared with `benchmark_baseline.json`.
+Exits with status 1 when a result regressed by more than the tolerance from a baseline recorded
+on the same kind of host.
+"""
+import argparse
+import datetime
+import logging
+import logging.config
+from pathlib import Path
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+
+# Import logging before models to ensure configuration is picked up
+logging.config.fileConfig(f"{Path(__file__).parents[0]}/logging.ini")
+# Modules shared with the consumers live at the repository root
+sys.path.append(str(Path(__file__).parents[1]))
+
+from common.benchmarking import check_baseline, write_results
+from models import Line
+from models.producer import Producer
+from models.sinks import NullSink
+from models.turnstile_hardware import TurnstileHardware
+from simulation import TimeSimulation
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BASELINE = Path(__file__).parents[0] / "benchmark_baseline.json"
+TIME_STEP = datetime.timedelta(minutes=5)
+
+
+def per_second(function, count):
+    """Returns how many of the `count` operations done by `function` take a second"""
+    start = time.perf_counter()
+    function()
+    return count / (time.perf_counter() - start)
+
+
+def run_simulation_benchmark(data_dir, ticks, seed):
+    """Returns the ticks per second of a headless seeded simulation, including its set up"""
+    simulation = TimeSimulation(time_step=TIME_STEP, seed=seed, data_dir=data_dir)
+    start_time = TimeSimulation.default_seeded_start
+    return per_second(
+        lambda: simulation.run(start_time, start_time + TIME_STEP * ticks, speed=0), ticks
+    )
+
+
+def run_line_benchmark(data_dir, ticks, seed):
+    """Returns the durations of `Line.run` over `ticks` ticks of every line, in milliseconds"""
+    simulation = TimeSimulation(time_step=TIME_STEP, seed=seed, data_dir=data_dir)
+    lines = [
+        Line(name, station_df, num_trains=trains, ridership=simulation.ridership)
+        for name, station_df, trains in simulation.line_specs
+    ]
+    durations = []
+    timestamp = TimeSimulation.default_seeded_start
+    for _ in range(ticks):
+        entries = simulation.ridership.get_entries(timestamp, TIME_STEP)
+        for line in lines:
+            start = time.perf_counter()
+            line.run(timestamp, TIME_STEP, entries)
+            durations.append((time.perf_counter() - start) * 1000)
+        timestamp += TIME_STEP
+    return durations
+
+
+def run_turnstile_benchmark(count):
+    """Returns the `TurnstileHardware.get_entries` calls per second, over a simulated day"""
+    stations_df = pd.read_csv(TimeSimulation.default_data_dir / "cta_stations.csv")
+    station_id = int(stations_df["station_id"].iloc[0])
+    hardware = TurnstileHardware(SimpleNamespace(station_id=station_id))
+    start_time = TimeSimulation.default_seeded_start
+    timestamps = [start_time + TIME_STEP * (index % 288) for index in range(count)]
+    return per_second(
+        lambda: [hardware.get_entries(timestamp, TIME_STEP) for timestamp in timestamps], count
+    )
+
+
+def run_serialization_benchmark(count):
+    """Returns the turnstile events per second encoded and produced by a `Producer`"""
+    producer = Producer(
+        "benchmark.turnstile", key_schema="turnstile_key", value_schema="turnstile_value"
+    )
+    values = [
+        {
+            "station_id": 40000 + index % 100,
+            "station_name": f"station {index % 100}",
+            "line": "blue",
+            "num_entries": index % 50,
+            "window_start": index * 300000,
+            "window_end": (index + 1) * 300000,
+        }
+        for index in range(count)
+    ]
+    return per_second(lambda: [producer.produce(value) for value in values], count)
+
+
+def parse_args(args=None):
+    """Parses the benchmark command line arguments"""
+    parser = argparse.ArgumentParser(description="Benchmarks the producer hot paths")
+    parser.add_argument(
+        "--data-dir", default=None,
+        help="network to simulate, for example one created by generate_network.py"
+    )
+    parser.add_argument("--ticks", type=int, default=288, help="simulated 5 minute ticks")
+    parser.add_argument(
+        "--calls", type=int, default=20000,
+        help="turnstile entry calls and serialized events"
+    )
+    parser.add_argument("--seed", type=int, default=1, help="seed of the simulation")
+    parser.add_argument("--output", help="file the results are written to as JSON")
+    parser.add_argument(
+        "--baseline", default=str(DEFAULT_BASELINE),
+        help="JSON results to compare with, an empty value skips the comparison"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.5,
+        help="fraction by which a result may be worse than its baseline"
+    )
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    logging.getLogger("models").setLevel(logging.WARNING)
+    logging.getLogger("simulation").setLevel(logging.WARNING)
+    Producer.sink = NullSink()
+
+    line_durations = run_line_benchmark(arguments.data_dir, arguments.ticks, arguments.seed)
+    results = {
+        "simulation_ticks_per_second": {
+            "value": run_simulation_benchmark(
+                arguments.data_dir, arguments.ticks, arguments.seed
+            ),
+            "unit": "ticks/s",
+            "higher_is_better": True,
+        },
+        "line_run_ms": {
+            "value": statistics.median(line_durations), "unit": "ms", "higher_is_better": False
+        },
+        "turnstile_entries_per_second": {
+            "value": run_turnstile_benchmark(arguments.calls),
+            "unit": "calls/s",
+            "higher_is_better": True,
+        },
+        "serialized_events_per_second": {
+            "value": run_serialization_benchmark(arguments.calls),
+            "unit": "events/s",
+            "higher_is_better": True,
+        },
+    }
+    for name, result in results.items():
+        logger.info("%s: %.2f %s", name, result["value"], result["unit"])
+
+    # Results are only comparable for the same network and parameters
+    workload = {
+        "network": arguments.data_dir or "cta",
+        "ticks": arguments.ticks,
+        "calls": arguments.calls,
+        "seed": arguments.seed,
+    }
+    if arguments.output:
+        write_results(arguments.output, workload, results)
+    if check_baseline(arguments.baseline, workload, results, arguments.tolerance):
+        sys.exit(1)
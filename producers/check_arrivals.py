@@ -0,0 +1,104 @@
+"""Checks that trains arrive at stations in the recorded order.
+
+`arrival_sequences.json` holds the arrivals of a few seeded lines, tick by tick, as
+`station_id train_id direction prev_station_id prev_direction` strings. The first tick is the
+placement of the trains when the line is created. Cases are recorded from the station scans
+that `Line._advance_trains` used before it walked the train positions in a single pass. With
+trains on adjacent stations those scans advanced some trains twice, so the adjacent trains case
+is recorded from the single pass and pins down that change.
+
+Run with `python check_arrivals.py`. Exits with status 1 when a sequence differs.
+"""
+import argparse
+import datetime
+import json
+import logging
+import logging.config
+from pathlib import Path
+import sys
+
+# Import logging before models to ensure configuration is picked up
+logging.config.fileConfig(f"{Path(__file__).parents[0]}/logging.ini")
+# Modules shared with the consumers live at the repository root
+sys.path.append(str(Path(__file__).parents[1]))
+
+from models import Line
+from models.producer import Producer
+from models.sinks import NullSink
+from models.station import Station
+from simulation import TimeSimulation
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIXTURE = Path(__file__).parents[0] / "arrival_sequences.json"
+TIME_STEP = datetime.timedelta(minutes=5)
+
+
+def record_arrivals(simulation, line_name, num_trains, ticks):
+    """Returns the arrivals of a new line of the simulation's network, per tick"""
+    station_df = next(df for name, df, _ in simulation.line_specs if name == line_name)
+    arrivals = [[]]
+    run = Station.run
+
+    def recording_run(station, train, direction, prev_station_id, prev_direction):
+        arrivals[-1].append(
+            f"{station.station_id} {train.train_id} {direction} "
+            f"{'-' if prev_station_id is None else prev_station_id} {prev_direction or '-'}"
+        )
+        run(station, train, direction, prev_station_id, prev_direction)
+
+    Station.run = recording_run
+    try:
+        line = Line(line_name, station_df, num_trains=num_trains, ridership=simulation.ridership)
+        timestamp = TimeSimulation.default_seeded_start
+        for _ in range(ticks):
+            arrivals.append([])
+            line.run(timestamp, TIME_STEP, simulation.ridership.get_entries(timestamp, TIME_STEP))
+            timestamp += TIME_STEP
+    finally:
+        Station.run = run
+    return arrivals
+
+
+def compare_arrivals(expected, actual):
+    """Returns a description of the first tick whose arrivals differ, or None"""
+    for tick, (expected_tick, actual_tick) in enumerate(zip(expected, actual)):
+        if expected_tick != actual_tick:
+            return f"tick {tick}: expected {expected_tick}, got {actual_tick}"
+    if len(expected) != len(actual):
+        return f"expected {len(expected)} ticks, got {len(actual)}"
+    return None
+
+
+def parse_args(args=None):
+    """Parses the check command line arguments"""
+    parser = argparse.ArgumentParser(description="Checks the recorded train arrival sequences")
+    parser.add_argument(
+        "--fixture", default=str(DEFAULT_FIXTURE), help="JSON file of the expected sequences"
+    )
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    logging.getLogger("models").setLevel(logging.WARNING)
+    Producer.sink = NullSink()
+
+    with open(arguments.fixture) as fixture_file:
+        fixture = json.load(fixture_file)
+    simulation = TimeSimulation(time_step=TIME_STEP, seed=fixture["seed"])
+    failed = False
+    for case in fixture["cases"]:
+        difference = compare_arrivals(
+            case["arrivals"],
+            record_arrivals(simulation, case["line"], case["num_trains"], fixture["ticks"]),
+        )
+        name = f'{case["line"]} line with {case["num_trains"]} trains'
+        if difference is None:
+            logger.info("%s: same arrivals", name)
+        else:
+            logger.error("%s (%s): %s", name, case["recorded_from"], difference)
+            failed = True
+    if failed:
+        sys.exit(1)
@@ -0,0 +1,132 @@
+"""Generates synthetic train networks in the format of the bundled CTA data.
+
+The output directory can be passed to `simulation.py --data-dir` to capacity test the pipeline
+with networks much larger than the CTA "L".
+"""
+import argparse
+import csv
+import logging
+from pathlib import Path
+import random
+
+
+logger = logging.getLogger(__name__)
+
+STATIONS_HEADER = [
+    "stop_id",
+    "direction_id",
+    "stop_name",
+    "station_name",
+    "station_descriptive_name",
+    "station_id",
+    "order",
+]
+RIDERSHIP_HEADER = [
+    "station_id",
+    "stationame",
+    "month_beginning",
+    "avg_weekday_rides",
+    "avg_saturday_rides",
+    "avg_sunday-holiday_rides",
+    "monthtotal",
+]
+# Ids are offset so generated stations never collide with CTA station and stop ids
+FIRST_STATION_ID = 100000
+FIRST_STOP_ID = 1000000
+
+
+def line_name(index):
+    """Returns the name of the line at the given index"""
+    return f"line_{index:03d}"
+
+
+def generate_network(output_dir, num_lines, stations_per_line, trains_per_line, seed=None):
+    """Writes stations, ridership seed and per-line train counts to `output_dir`"""
+    if stations_per_line < 2:
+        raise ValueError("A line needs at least two stations")
+    if not 0 < trains_per_line <= (stations_per_line - 1) * 2:
+        raise ValueError(
+            f"{stations_per_line} stations per line can run between 1 and "
+            f"{(stations_per_line - 1) * 2} trains"
+        )
+
+    rand = random.Random(seed)
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    lines = [line_name(index) for index in range(num_lines)]
+
+    with open(output_dir / "cta_stations.csv", "w", newline="") as stations_file, open(
+        output_dir / "ridership_seed.csv", "w", newline=""
+    ) as ridership_file:
+        stations = csv.writer(stations_file)
+        stations.writerow(STATIONS_HEADER + lines)
+        ridership = csv.writer(ridership_file)
+        ridership.writerow(RIDERSHIP_HEADER)
+
+        stop_id = FIRST_STOP_ID
+        for line_index, line in enumerate(lines):
+            flags = ["TRUE" if index == line_index else "FALSE" for index in range(num_lines)]
+            for order in range(stations_per_line):
+                station_id = FIRST_STATION_ID + line_index * stations_per_line + order
+                station_name = f"{line} station {order:03d}"
+                for direction in ("E", "W"):
+                    stations.writerow([
+                        stop_id,
+                        direction,
+                        f"{station_name} ({direction}-bound)",
+                        station_name,
+                        f"{station_name} ({line})",
+                        station_id,
+                        order,
+                    ] + flags)
+                    stop_id += 1
+
+                # Roughly log-normal ridership, like the skew between downtown and outer stations
+                weekday = min(rand.lognormvariate(8.0, 0.8), 30000.0)
+                saturday = weekday * rand.uniform(0.3, 0.6)
+                sunday = saturday * rand.uniform(0.7, 0.95)
+                ridership.writerow([
+                    station_id,
+                    station_name,
+                    "10/01/2018",
+                    round(weekday, 1),
+                    round(saturday, 1),
+                    round(sunday, 1),
+                    int(weekday * 22 + saturday * 4 + sunday * 5),
+                ])
+
+    with open(output_dir / "lines.csv", "w", newline="") as lines_file:
+        writer = csv.writer(lines_file)
+        writer.writerow(["line", "num_trains"])
+        writer.writerows([line, trains_per_line] for line in lines)
+
+    logger.info(
+        "generated %s lines with %s stations and %s trains each in %s",
+        num_lines,
+        stations_per_line,
+        trains_per_line,
+        output_dir,
+    )
+
+
+def parse_args(args=None):
+    """Parses the generator command line arguments"""
+    parser = argparse.ArgumentParser(description="Generates a synthetic train network")
+    parser.add_argument("output_dir", help="directory to write the network data to")
+    parser.add_argument("--lines", type=int, default=30, help="number of lines")
+    parser.add_argument("--stations", type=int, default=40, help="stations per line")
+    parser.add_argument("--trains", type=int, default=10, help="trains per line")
+    parser.add_argument("--seed", type=int, help="seed for the generated ridership")
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    arguments = parse_args()
+    generate_network(
+        arguments.output_dir,
+        arguments.lines,
+        arguments.stations,
+        arguments.trains,
+        arguments.seed,
+    )
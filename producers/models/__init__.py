@@ -1,3 +1,4 @@
+from .ridership import RidershipEngine
 from .turnstile import Turnstile
 from .station import Station
 from .train import Train
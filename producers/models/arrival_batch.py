@@ -0,0 +1,51 @@
+"""Collects the train arrivals of a line during a tick into a single columnar event"""
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class ArrivalBatch:
+    """Parallel arrays of arrivals, matching the `arrival_batch_value` schema"""
+
+    def __init__(self, line):
+        self.line = line
+        self.station_ids = []
+        self.train_ids = []
+        self.directions = []
+        self.train_statuses = []
+        self.prev_station_ids = []
+        self.prev_directions = []
+
+    def __len__(self):
+        return len(self.station_ids)
+
+    def add(self, station_id, train_id, direction, train_status, prev_station_id, prev_direction):
+        """Adds an arrival to the batch"""
+        self.station_ids.append(station_id)
+        self.train_ids.append(train_id)
+        self.directions.append(direction)
+        self.train_statuses.append(train_status)
+        self.prev_station_ids.append(prev_station_id)
+        self.prev_directions.append(prev_direction)
+
+    def to_record(self):
+        """Returns the batch as an event value"""
+        return {
+            "line": self.line,
+            "station_ids": self.station_ids,
+            "train_ids": self.train_ids,
+            "directions": self.directions,
+            "train_statuses": self.train_statuses,
+            "prev_station_ids": self.prev_station_ids,
+            "prev_directions": self.prev_directions,
+        }
+
+    def clear(self):
+        """Empties the batch for the next tick"""
+        self.station_ids = []
+        self.train_ids = []
+        self.directions = []
+        self.train_statuses = []
+        self.prev_station_ids = []
+        self.prev_directions = []
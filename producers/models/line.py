@@ -3,6 +3,7 @@ from enum import IntEnum
 import logging
 
 from models import Station, Train
+from models.arrival_batch import ArrivalBatch
 
 
 logger = logging.getLogger(__name__)
@@ -13,14 +14,33 @@ class Line:
 
     colors = IntEnum("colors", "blue green red", start=0)
     num_directions = 2
+    default_num_trains = 10
 
-    def __init__(self, color, station_data, num_trains=10):
-        self.color = color
+    def __init__(self, color, station_data, num_trains=default_num_trains, ridership=None):
+        """Creates a line. `color` is the line name, CTA lines may also pass a `Line.colors`"""
+        self.color = getattr(color, "name", color)
         self.num_trains = num_trains
         self.stations = self._build_line_data(station_data)
         # We must always discount the terminal station at the end of each direction
         self.num_stations = len(self.stations) - 1
+        if not 0 < self.num_trains <= self.num_stations * Line.num_directions:
+            raise ValueError(
+                f'Line {self.color} with {len(self.stations)} stations cannot run '
+                f'{self.num_trains} trains'
+            )
+        self.arrival_batch = None
+        if Station.arrival_mode == "batched":
+            self.arrival_batch = ArrivalBatch(self.color)
+            for station in self.stations:
+                station.arrival_batch = self.arrival_batch
         self.trains = self._build_trains()
+        self.flush_arrivals()
+        # Positions of this line's stations in the shared ridership engine output
+        self.ridership_index = None
+        if ridership is not None:
+            self.ridership_index = ridership.indices(
+                [station.station_id for station in self.stations]
+            )
 
     def _build_line_data(self, station_df):
         """Constructs all stations on the line"""
@@ -47,124 +67,93 @@ class Line:
     def _build_trains(self):
         """Constructs and assigns train objects to stations"""
         trains = []
+        # (station index, is b direction) of every train, aligned with `self.trains`
+        self.train_positions = []
+        # Trains are built in the order they sit along the line, starting at the beginning of
+        # the b direction, which is also the order in which they are advanced
+        self.first_train = 0
         curr_loc = 0
         b_dir = True
+        prefix = f"{self.color.upper()}-"
+        if self.color in Line.colors.__members__:
+            prefix = f"{self.color[0].upper()}L"
         for train_id in range(self.num_trains):
             tid = str(train_id).zfill(3)
-            train = Train(
-                f"{self.color.name[0].upper()}L{tid}", Train.status.in_service
-            )
+            train = Train(f"{prefix}{tid}", Train.status.in_service)
             trains.append(train)
 
             if b_dir:
                 self.stations[curr_loc].arrive_b(train, None, None)
             else:
                 self.stations[curr_loc].arrive_a(train, None, None)
+            self.train_positions.append((curr_loc, b_dir))
             curr_loc, b_dir = self._get_next_idx(curr_loc, b_dir)
 
         return trains
 
-    def run(self, timestamp, time_step):
-        """Advances trains between stations in the simulation. Runs turnstiles."""
-        self._advance_turnstiles(timestamp, time_step)
+    def run(self, timestamp, time_step, entries=None):
+        """Advances trains between stations in the simulation. Runs turnstiles.
+
+        `entries` is the output of `RidershipEngine.get_entries` for this tick. When it is not
+        given every station computes its own turnstile entries.
+        """
+        self._advance_turnstiles(timestamp, time_step, entries)
         self._advance_trains()
+        self.flush_arrivals()
+
+    def flush_arrivals(self):
+        """Emits the arrivals batched during this tick, if arrivals are batched"""
+        if self.arrival_batch is not None:
+            Station.produce_batch(self.arrival_batch)
 
     def close(self):
         """Called to stop the simulation"""
         _ = [station.close() for station in self.stations]
 
-    def _advance_turnstiles(self, timestamp, time_step):
+    def _advance_turnstiles(self, timestamp, time_step, entries=None):
         """Advances the turnstiles in the simulation"""
-        _ = [station.turnstile.run(timestamp, time_step) for station in self.stations]
+        if entries is None or self.ridership_index is None:
+            _ = [station.turnstile.run(timestamp, time_step) for station in self.stations]
+            return
+
+        station_entries = entries[self.ridership_index].tolist()
+        for station, num_entries in zip(self.stations, station_entries):
+            station.turnstile.run(timestamp, time_step, num_entries)
 
     def _advance_trains(self):
-        """Advances trains between stations in the simulation"""
-        # Find the first b train
-        curr_train, curr_index, b_direction = self._next_train()
-        self.stations[curr_index].b_train = None
-
-        trains_advanced = 0
-        while trains_advanced < self.num_trains - 1:
-            # The train departs the current station
+        """Advances trains between stations in the simulation.
+
+        Trains are advanced one station each, from the beginning of the b direction to the end
+        of the a direction, in a single pass over `self.train_positions`.
+        """
+        num_trains = len(self.trains)
+        order = [(self.first_train + offset) % num_trains for offset in range(num_trains)]
+        for train_index in order:
+            train = self.trains[train_index]
+            curr_index, b_direction = self.train_positions[train_index]
+            station = self.stations[curr_index]
+
+            # The train departs the current station, unless the train behind it already arrived
             if b_direction is True:
-                self.stations[curr_index].b_train = None
-            else:
-                self.stations[curr_index].a_train = None
-
-            prev_station = self.stations[curr_index].station_id
-            prev_dir = "b" if b_direction else "a"
+                if station.b_train is train:
+                    station.b_train = None
+            elif station.a_train is train:
+                station.a_train = None
 
             # Advance this train to the next station
-            curr_index, b_direction = self._get_next_idx(
+            next_index, next_b_direction = self._get_next_idx(
                 curr_index, b_direction, step_size=1
             )
-            if b_direction is True:
-                self.stations[curr_index].arrive_b(curr_train, prev_station, prev_dir)
-            else:
-                self.stations[curr_index].arrive_a(curr_train, prev_station, prev_dir)
-
-            # Find the next train to advance
-            move = 1 if b_direction else -1
-            next_train, curr_index, b_direction = self._next_train(
-                curr_index + move, b_direction
-            )
-            if b_direction is True:
-                curr_train = self.stations[curr_index].b_train
+            self.train_positions[train_index] = (next_index, next_b_direction)
+            prev_dir = "b" if b_direction else "a"
+            if next_b_direction is True:
+                self.stations[next_index].arrive_b(train, station.station_id, prev_dir)
             else:
-                curr_train = self.stations[curr_index].a_train
-
-            curr_train = next_train
-            trains_advanced += 1
-
-        # The last train departs the current station
-        if b_direction is True:
-            self.stations[curr_index].b_train = None
-        else:
-            self.stations[curr_index].a_train = None
-
-        # Advance last train to the next station
-        prev_station = self.stations[curr_index].station_id
-        prev_dir = "b" if b_direction else "a"
-        curr_index, b_direction = self._get_next_idx(
-            curr_index, b_direction, step_size=1
-        )
-        if b_direction is True:
-            self.stations[curr_index].arrive_b(curr_train, prev_station, prev_dir)
-        else:
-            self.stations[curr_index].arrive_a(curr_train, prev_station, prev_dir)
+                self.stations[next_index].arrive_a(train, station.station_id, prev_dir)
 
-    def _next_train(self, start_index=0, b_direction=True, step_size=1):
-        """Given a starting index, finds the next train in either direction"""
-        if b_direction is True:
-            curr_index = self._next_train_b(start_index, step_size)
-
-            if curr_index == -1:
-                curr_index = self._next_train_a(len(self.stations) - 1, step_size)
-                b_direction = False
-        else:
-            curr_index = self._next_train_a(start_index, step_size)
-
-            if curr_index == -1:
-                curr_index = self._next_train_b(0, step_size)
-                b_direction = True
-
-        if b_direction is True:
-            return self.stations[curr_index].b_train, curr_index, True
-        return self.stations[curr_index].a_train, curr_index, False
-
-    def _next_train_b(self, start_index, step_size):
-        """Finds the next train in the b direction, if any"""
-        for i in range(start_index, len(self.stations), step_size):
-            if self.stations[i].b_train is not None:
-                return i
-        return -1
-
-    def _next_train_a(self, start_index, step_size):
-        """Finds the next train in the a direction, if any"""
-        for i in range(start_index, 0, -step_size):
-            if self.stations[i].a_train is not None:
-                return i
-        return -1
+        # The last train wrapped around from the end of the a direction, so it goes first next
+        if self.train_positions[order[-1]] == (0, True):
+            self.first_train = order[-1]
 
     def _get_next_idx(self, curr_index, b_direction, step_size=None):
         """Calculates the next station index. Returns next index and if it is b direction"""
@@ -1,21 +1,38 @@
 """Producer base-class providing common utilites and functionality"""
+import datetime
 import logging
 import time
 import os
 import json
 
-from confluent_kafka.admin import AdminClient, NewTopic, ClusterMetadata
-from confluent_kafka.avro import AvroProducer
+from common import metrics
+from models.recorder import EventRecorder, process_recording_path
+from models.serialization import AvroSerializer
+from models.sinks import FileSink, sink_from_env
 
 logger = logging.getLogger(__name__)
 
+PRODUCE_LATENCY = metrics.Histogram(
+    "producer_produce_latency_seconds",
+    "Time from producing an event until Kafka acknowledged it",
+    ("topic",),
+)
+
 
 class Producer:
     """Defines and provides common functionality amongst Producers"""
 
     # Tracks existing topics across all Producer instances
     existing_topics = set([])
-    admin: AdminClient = None
+    # A single sink and serializer are shared by all Producer instances, see models/sinks.py
+    sink = None
+    serializer: AvroSerializer = None
+    # Tracks every Producer created so throughput can be reported for the whole simulation
+    instances = []
+    # Records every produced event when set, see models/recorder.py
+    recorder = None
+    # Event keys use the simulated time instead of the wall clock when set, in epoch millis
+    simulated_time_millis = None
 
     def __init__(
         self,
@@ -25,64 +42,51 @@ class Producer:
         num_partitions=1,
         num_replicas=1,
     ):
-        """Initializes a Producer object with basic settings"""
+        """Initializes a Producer object with basic settings.
+
+        `key_schema` and `value_schema` are names of schemas under `models/schemas`.
+        """
         self.topic_name = topic_name
         self.key_schema = key_schema
         self.value_schema = value_schema
         self.num_partitions = num_partitions
         self.num_replicas = num_replicas
 
-        self.broker_properties = {
-            "bootstrap.servers": os.getenv('KAFKA_URL'),
-            "schema.registry.url": os.getenv('SCHEMA_REGISTRY_URL'),
-            "group.id": "producer-1"
-        }
+        self.produced = 0
+        self.delivered = 0
+        self.failed = 0
+        self.buffer_retries = 0
+        self.started_at = time.monotonic()
+        self._produce_latency = PRODUCE_LATENCY.labels(self.topic_name)
 
+        self.sink = self.get_sink()
         if self.topic_name not in Producer.existing_topics:
-            self.create_topic()
+            self.sink.create_topic(self.topic_name, self.num_partitions, self.num_replicas)
             Producer.existing_topics.add(self.topic_name)
 
-        self.producer = AvroProducer(self.broker_properties, key_schema, value_schema)
-
-    def create_topic(self):
-        """Creates the producer topic if it does not already exist"""
-        admin = self._get_admin_client()
-        topic_metadata: ClusterMetadata = admin.list_topics(timeout=5)
-        topic_producer_exists: bool = self.topic_name in topic_metadata.topics
-
-        if topic_producer_exists:
-            return
-
-        futures = admin.create_topics([
-            NewTopic(
-                topic = self.topic_name,
-                num_partitions=self.num_partitions,
-                replication_factor=self.num_replicas,
-                config={
-                    "cleanup.policy": "delete",
-                    "compression.type": "lz4",
-                    "delete.retention.ms": "2000",
-                    "file.delete.delay.ms": "2000",
-                }
-            )
-        ])
-
-        topic_creation = futures[self.topic_name]
-        try:
-            topic_creation.result()
-        except Exception as exception:
-            logger.error('Failed to create Kafka topic: %s', self.topic_name)
-            raise exception
+        self.serializer = self._get_serializer()
+        self.key_subject = f"{self.topic_name}-key"
+        self.value_subject = f"{self.topic_name}-value"
+        self.serializer.register(self.key_subject, self.key_schema)
+        if self.value_schema is not None:
+            self.serializer.register(self.value_subject, self.value_schema)
+        Producer.instances.append(self)
 
     def produce(self, value):
-        """Produce a kafka event"""
-        logger.info("producing event: %s", self.topic_name)
+        """Produce a kafka event.
+
+        Delivery happens asynchronously with the Kafka sink, see `on_delivery`.
+        """
+        logger.debug("producing event: %s", self.topic_name)
         try:
-            self.producer.produce(
-                topic=self.topic_name,
-                key={"timestamp": self.time_millis()},
-                value=value
+            timestamp = self.time_millis()
+            key = self.serializer.encode(
+                self.key_subject, self.key_schema, {"timestamp": timestamp}
             )
+            value_bytes = self.serializer.encode(self.value_subject, self.value_schema, value)
+            if Producer.recorder is not None:
+                Producer.recorder.write(self, timestamp, key, value_bytes)
+            self.produce_encoded(key, value_bytes, timestamp)
         except Exception as exception:
             logger.error(
                 'Failed to send event to kafka.\nTopic name: %s\nEvent value: %s\n',
@@ -91,15 +95,144 @@ class Producer:
             )
             raise exception
 
-    def _get_admin_client(self):
-        if Producer.admin is None:
-            Producer.admin = AdminClient({ 'bootstrap.servers': os.getenv('KAFKA_URL')})
-        return Producer.admin
+    def produce_encoded(self, key, value, timestamp_ms=None):
+        """Produce an event whose key and value are already encoded"""
+        if timestamp_ms is None:
+            timestamp_ms = self.time_millis()
+        self.sink.produce(self, timestamp_ms, key, value)
+        self.produced += 1
+
+    def on_delivery(self, err, msg):
+        """Delivery report callback, called by the sink. Local sinks report no message."""
+        if err is not None:
+            self.failed += 1
+            logger.error('Failed to deliver event to topic %s: %s', self.topic_name, err)
+            return
+        self.delivered += 1
+        if msg is not None:
+            latency = msg.latency()
+            if latency is not None:
+                self._produce_latency.observe(latency)
+
+    @property
+    def in_flight(self):
+        """Number of events of this producer neither delivered nor failed yet"""
+        return self.produced - self.delivered - self.failed
+
+    def stats(self):
+        """Returns delivery counters and the sustained delivery rate of this producer"""
+        elapsed = time.monotonic() - self.started_at
+        return {
+            "topic": self.topic_name,
+            "produced": self.produced,
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "in_flight": self.in_flight,
+            "buffer_retries": self.buffer_retries,
+            "events_per_second": self.delivered / elapsed if elapsed > 0 else 0.0,
+        }
+
+    @classmethod
+    def log_stats(cls):
+        """Logs the counters of every producer created so far"""
+        for producer in cls.instances:
+            logger.info(
+                "%(topic)s: produced=%(produced)d delivered=%(delivered)d failed=%(failed)d "
+                "in_flight=%(in_flight)d buffer_retries=%(buffer_retries)d "
+                "events_per_second=%(events_per_second).1f",
+                producer.stats()
+            )
+        # The queue is shared by every producer of the process
+        if cls.sink is not None:
+            logger.info(
+                "%d events waiting in the local queue or for acknowledgement", len(cls.sink)
+            )
+
+    @classmethod
+    def get_sink(cls):
+        """Returns the shared sink, created on first use from `PRODUCER_SINK`"""
+        if Producer.sink is None:
+            Producer.sink = sink_from_env()
+            logger.info("producing to %s", type(Producer.sink).__name__)
+        return Producer.sink
+
+    def _get_serializer(self):
+        if Producer.serializer is None:
+            # Local sinks run without the schema registry, their schema ids stay in memory
+            url = os.getenv('SCHEMA_REGISTRY_URL') if self.sink.requires_services else None
+            Producer.serializer = AvroSerializer.from_url(url)
+        return Producer.serializer
 
     def close(self):
         """Prepares the producer for exit by cleaning up the producer"""
-        self.producer.flush()
+        self.sink.flush()
+
+    @classmethod
+    def record_to(cls, record_dir):
+        """Records every produced event to the file of this process in `record_dir`"""
+        path = process_recording_path(record_dir)
+        sink = cls.get_sink()
+        # Both recorders would truncate the same file, the file sink already records the events
+        if isinstance(sink, FileSink) and sink.recorder.path.resolve() == path.resolve():
+            logger.info("recording to %s through the file sink", path)
+            return
+        cls.recorder = EventRecorder(path)
+
+    @classmethod
+    def close_sinks(cls):
+        """Closes the shared sink and the recorder once every producer is closed"""
+        if cls.sink is not None:
+            cls.sink.close()
+        if cls.recorder is not None:
+            cls.recorder.close()
 
     def time_millis(self):
         """Use this function to get the key for Kafka Events"""
+        if Producer.simulated_time_millis is not None:
+            return Producer.simulated_time_millis
         return int(round(time.time() * 1000))
+
+    @classmethod
+    def set_simulated_time(cls, timestamp):
+        """Keys the following events with a naive UTC simulation timestamp"""
+        cls.simulated_time_millis = int(
+            timestamp.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000
+        )
+
+
+def _per_topic(attribute):
+    """Returns ((topic,), total) pairs of a counter of the producers, for metrics"""
+    totals = {}
+    for producer in list(Producer.instances):
+        key = (producer.topic_name,)
+        totals[key] = totals.get(key, 0) + getattr(producer, attribute)
+    return totals.items()
+
+
+# Counters already kept by every producer are read when the metrics are scraped
+metrics.Collected(
+    "producer_events_total", "Events produced", "counter", ("topic",),
+    lambda: _per_topic("produced"),
+)
+metrics.Collected(
+    "producer_delivered_total", "Events delivered by the sink", "counter", ("topic",),
+    lambda: _per_topic("delivered"),
+)
+metrics.Collected(
+    "producer_failed_total", "Events the sink failed to deliver", "counter", ("topic",),
+    lambda: _per_topic("failed"),
+)
+metrics.Collected(
+    "producer_buffer_retries_total",
+    "Produce calls retried because the local queue was full",
+    "counter",
+    ("topic",),
+    lambda: _per_topic("buffer_retries"),
+)
+metrics.Collected(
+    "producer_queue_depth",
+    "Events waiting in the local queue or for acknowledgement",
+    "gauge",
+    (),
+    lambda: [((), len(Producer.sink) if Producer.sink is not None else 0)],
+)
@@ -0,0 +1,109 @@
+"""Records produced events to local files so a run can be replayed into Kafka"""
+import json
+import logging
+import multiprocessing
+from pathlib import Path
+import struct
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"CTAEVENTS1\n"
+# Every record is its type and payload length followed by the payload
+RECORD_HEADER = struct.Struct(">BI")
+TOPIC_RECORD = 0
+EVENT_RECORD = 1
+# Event payloads start with the topic id, the event time and the key length, then hold the
+# Avro encoded key followed by the Avro encoded value
+EVENT_HEADER = struct.Struct(">HqI")
+TOPIC_ID = struct.Struct(">H")
+FILE_SUFFIX = ".events"
+
+
+class EventRecorder:
+    """Appends the events of every producer of a process to a length-prefixed file.
+
+    Keys and values are kept exactly as produced, in the Confluent Avro wire format. The first
+    event of each topic is preceded by the topic name and schema names, so the events can be
+    replayed against another schema registry.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.recorded = 0
+        self._topic_ids = {}
+        self._file = open(self.path, "wb")
+        self._file.write(MAGIC)
+
+    def write(self, producer, timestamp_ms, key, value):
+        """Appends an event produced by the producer"""
+        topic_id = self._topic_ids.get(producer.topic_name)
+        if topic_id is None:
+            topic_id = self._write_topic(producer)
+        payload_length = EVENT_HEADER.size + len(key) + len(value)
+        self._file.write(RECORD_HEADER.pack(EVENT_RECORD, payload_length))
+        self._file.write(EVENT_HEADER.pack(topic_id, timestamp_ms, len(key)))
+        self._file.write(key)
+        self._file.write(value)
+        self.recorded += 1
+
+    def _write_topic(self, producer):
+        topic_id = len(self._topic_ids)
+        topic = json.dumps({
+            "name": producer.topic_name,
+            "key_schema": producer.key_schema,
+            "value_schema": producer.value_schema,
+            "num_partitions": producer.num_partitions,
+        }).encode("utf-8")
+        self._file.write(RECORD_HEADER.pack(TOPIC_RECORD, TOPIC_ID.size + len(topic)))
+        self._file.write(TOPIC_ID.pack(topic_id))
+        self._file.write(topic)
+        self._topic_ids[producer.topic_name] = topic_id
+        return topic_id
+
+    def close(self):
+        """Flushes and closes the file"""
+        self._file.close()
+        logger.info("recorded %s events to %s", self.recorded, self.path)
+
+
+def process_recording_path(record_dir):
+    """Returns the recording file of the current process in `record_dir`. Every process of a
+    simulation writes its own file, `main` for the main process.
+    """
+    name = multiprocessing.current_process().name
+    if name == "MainProcess":
+        name = "main"
+    return Path(record_dir) / f"{name}{FILE_SUFFIX}"
+
+
+def read_events(path):
+    """Yields (event time, topic, key, value) for every event of a recording file. `topic` is a
+    dict with the topic name, schema names and number of partitions.
+    """
+    with open(path, "rb") as events_file:
+        if events_file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not an event recording")
+        topics = {}
+        while True:
+            header = events_file.read(RECORD_HEADER.size)
+            if not header:
+                return
+            if len(header) < RECORD_HEADER.size:
+                raise ValueError(f"{path} ends with a truncated record")
+            record_type, length = RECORD_HEADER.unpack(header)
+            payload = events_file.read(length)
+            if len(payload) < length:
+                raise ValueError(f"{path} ends with a truncated record")
+
+            if record_type == TOPIC_RECORD:
+                (topic_id,) = TOPIC_ID.unpack_from(payload)
+                topics[topic_id] = json.loads(payload[TOPIC_ID.size:].decode("utf-8"))
+            elif record_type == EVENT_RECORD:
+                topic_id, timestamp_ms, key_length = EVENT_HEADER.unpack_from(payload)
+                key_end = EVENT_HEADER.size + key_length
+                key = payload[EVENT_HEADER.size:key_end]
+                yield timestamp_ms, topics[topic_id], key, payload[key_end:]
+            else:
+                raise ValueError(f"{path} holds an unknown record type {record_type}")
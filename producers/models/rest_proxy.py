@@ -0,0 +1,116 @@
+"""Publishes Avro records to Kafka through REST Proxy without blocking the simulation"""
+import json
+import logging
+import queue
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+logger = logging.getLogger(__name__)
+
+
+class RestProxyPublisher:
+    """Posts records to a topic from a background thread over a pooled keep-alive session.
+
+    Records queued while a post is in flight are sent together in the next request. Full
+    schemas are only sent until REST Proxy returns their ids. The outcome of every record is
+    reported to `on_delivery(err, msg)` like the sinks do, without a message.
+    """
+
+    content_type = "application/vnd.kafka.avro.v2+json"
+    request_timeout = 10
+
+    def __init__(self, url, topic_name, key_schema, value_schema, on_delivery,
+                 max_batch_size=50, max_pending=1000):
+        self.topic_url = f"{url}/topics/{topic_name}"
+        self.topic_name = topic_name
+        self.max_batch_size = max_batch_size
+        self.key_schema = json.dumps(key_schema)
+        self.value_schema = json.dumps(value_schema)
+        self.key_schema_id = None
+        self.value_schema_id = None
+        self.on_delivery = on_delivery
+
+        self.session = requests.Session()
+        self.session.headers.update({"Content-Type": RestProxyPublisher.content_type})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._closed = object()
+        self._thread = threading.Thread(
+            target=self._run, name=f"rest-proxy-{topic_name}", daemon=True
+        )
+        self._thread.start()
+
+    def publish(self, key, value):
+        """Queues a record for the background thread. Drops it if too many are pending."""
+        try:
+            self._queue.put_nowait({"key": key, "value": value})
+        except queue.Full:
+            logger.error(
+                "REST Proxy publisher for %s is falling behind, dropping record %s",
+                self.topic_name,
+                json.dumps(value)
+            )
+            self.on_delivery("REST Proxy publisher queue is full", None)
+
+    def close(self, timeout=None):
+        """Sends the pending records and stops the background thread"""
+        self._queue.put(self._closed)
+        self._thread.join(timeout)
+        self.session.close()
+
+    def _run(self):
+        closed = False
+        while not closed:
+            records = [self._queue.get()]
+            while len(records) < self.max_batch_size:
+                try:
+                    records.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if records[-1] is self._closed:
+                closed = True
+                records.pop()
+            if records:
+                self._post(records)
+
+    def _post(self, records):
+        payload = {"records": records}
+        if self.key_schema_id is None or self.value_schema_id is None:
+            payload["key_schema"] = self.key_schema
+            payload["value_schema"] = self.value_schema
+        else:
+            payload["key_schema_id"] = self.key_schema_id
+            payload["value_schema_id"] = self.value_schema_id
+
+        try:
+            resp = self.session.post(
+                self.topic_url,
+                data=json.dumps(payload),
+                timeout=RestProxyPublisher.request_timeout,
+            )
+            resp.raise_for_status()
+            body = resp.json()
+        except (requests.RequestException, ValueError) as exception:
+            logger.error(
+                "Failed to send %s events to topic %s throughout Rest API.\n"
+                "records: %s\nexception: %s",
+                len(records),
+                self.topic_name,
+                json.dumps(records),
+                exception,
+            )
+            for _ in records:
+                self.on_delivery(exception, None)
+            return
+
+        self.key_schema_id = body.get("key_schema_id", self.key_schema_id)
+        self.value_schema_id = body.get("value_schema_id", self.value_schema_id)
+        for _ in records:
+            self.on_delivery(None, None)
+        logger.debug("sent %s records to %s", len(records), self.topic_name)
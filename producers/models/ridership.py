@@ -0,0 +1,77 @@
+"""Vectorized ridership model used to compute turnstile entries for every station at once"""
+from enum import IntEnum
+import logging
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+class RidershipEngine:
+    """Precomputes ridership data so a whole simulation tick is a single vectorized call"""
+
+    day_types = IntEnum("day_types", "weekday saturday sunday", start=0)
+    ridership_columns = ("avg_weekday_rides", "avg_saturday_rides", "avg_sunday-holiday_rides")
+    noise_range = (-5, 5)
+
+    def __init__(self, seed=None, curve_path=None, seed_path=None):
+        """Loads the ridership curve and seed data and builds the lookup arrays"""
+        data_dir = Path(__file__).parents[1] / "data"
+        curve_df = pd.read_csv(curve_path or data_dir / "ridership_curve.csv")
+        seed_df = pd.read_csv(seed_path or data_dir / "ridership_seed.csv")
+
+        # hour x day type matrix of ridership ratios. The curve is currently the same for
+        # every day type but keeping the day type axis lets us refine it without API changes.
+        hours = curve_df["hour"].to_numpy()
+        self.ratios = np.zeros((hours.max() + 1, len(RidershipEngine.day_types)))
+        self.ratios[hours] = curve_df["ridership_ratio"].to_numpy()[:, np.newaxis]
+
+        # station index x day type matrix of average daily rides
+        seed_df = seed_df.drop_duplicates("station_id")
+        self.station_ids = seed_df["station_id"].to_numpy()
+        self.ridership = np.rint(
+            seed_df[list(RidershipEngine.ridership_columns)].to_numpy(dtype=float)
+        ).astype(np.int64)
+        self._station_index = {
+            int(station_id): index for index, station_id in enumerate(self.station_ids)
+        }
+
+        self.rng = np.random.default_rng(seed)
+
+    def indices(self, station_ids):
+        """Returns the engine indices for the given station ids"""
+        try:
+            return np.array(
+                [self._station_index[int(station_id)] for station_id in station_ids],
+                dtype=np.intp
+            )
+        except KeyError as exception:
+            raise ValueError(f'No ridership data for station {exception.args[0]}') from exception
+
+    @staticmethod
+    def day_type(timestamp):
+        """Returns the ridership day type for the given timestamp"""
+        dow = timestamp.weekday()
+        if dow < 5:
+            return RidershipEngine.day_types.weekday
+        if dow == 5:
+            return RidershipEngine.day_types.saturday
+        return RidershipEngine.day_types.sunday
+
+    def get_entries(self, timestamp, time_step):
+        """Returns the number of turnstile entries of every station for the given timeframe.
+
+        The result is indexed like `station_ids`; use `indices` to select a subset of stations.
+        """
+        day_type = RidershipEngine.day_type(timestamp)
+        ratio = self.ratios[timestamp.hour, day_type]
+        total_steps = int(60 / (60 / time_step.total_seconds()))
+
+        # Calculate approximation of number of entries for this simulation step
+        num_entries = np.floor(self.ridership[:, day_type] * ratio / total_steps).astype(np.int64)
+        # Introduce some randomness in the data
+        num_entries += self.rng.integers(*RidershipEngine.noise_range, size=len(num_entries))
+        return np.maximum(num_entries, 0)
@@ -0,0 +1,165 @@
+"""Destinations of the events produced by the simulation"""
+from collections import deque
+import logging
+import os
+
+from confluent_kafka import Producer as KafkaProducer
+from confluent_kafka.admin import AdminClient, NewTopic, ClusterMetadata
+
+from models.recorder import EventRecorder, process_recording_path
+
+
+logger = logging.getLogger(__name__)
+
+
+class KafkaSink:
+    """Sends events to Kafka through a single librdkafka client"""
+
+    # Kafka topics are paired with the schema registry, REST Proxy and Kafka Connect
+    requires_services = True
+    # Seconds to wait for delivery reports to free up the local queue when it is full
+    buffer_full_poll_timeout = 0.1
+
+    def __init__(self):
+        self.broker_properties = {
+            "bootstrap.servers": os.getenv('KAFKA_URL'),
+            "linger.ms": int(os.getenv('PRODUCER_LINGER_MS', '50')),
+            "batch.num.messages": int(os.getenv('PRODUCER_BATCH_NUM_MESSAGES', '10000')),
+            "queue.buffering.max.messages": int(
+                os.getenv('PRODUCER_QUEUE_BUFFERING_MAX_MESSAGES', '500000')
+            ),
+            "compression.type": "lz4",
+        }
+        self.client = KafkaProducer(self.broker_properties)
+        self.admin = None
+
+    def create_topic(self, topic_name, num_partitions, num_replicas):
+        """Creates the topic if it does not already exist"""
+        if self.admin is None:
+            self.admin = AdminClient({'bootstrap.servers': os.getenv('KAFKA_URL')})
+        topic_metadata: ClusterMetadata = self.admin.list_topics(timeout=5)
+        if topic_name in topic_metadata.topics:
+            return
+
+        futures = self.admin.create_topics([
+            NewTopic(
+                topic=topic_name,
+                num_partitions=num_partitions,
+                replication_factor=num_replicas,
+                config={
+                    "cleanup.policy": "delete",
+                    "compression.type": "lz4",
+                    "delete.retention.ms": "2000",
+                    "file.delete.delay.ms": "2000",
+                }
+            )
+        ])
+
+        topic_creation = futures[topic_name]
+        try:
+            topic_creation.result()
+        except Exception as exception:
+            logger.error('Failed to create Kafka topic: %s', topic_name)
+            raise exception
+
+    def produce(self, producer, timestamp_ms, key, value):
+        """Queues the event for delivery.
+
+        When librdkafka's local queue is full the call waits for pending deliveries to complete
+        and retries instead of failing.
+        """
+        while True:
+            try:
+                self.client.produce(
+                    topic=producer.topic_name,
+                    key=key,
+                    value=value,
+                    on_delivery=producer.on_delivery
+                )
+                break
+            except BufferError:
+                producer.buffer_retries += 1
+                logger.debug("local producer queue is full for %s, waiting", producer.topic_name)
+                self.client.poll(KafkaSink.buffer_full_poll_timeout)
+
+        # Serve delivery reports of previous events without blocking
+        self.client.poll(0)
+
+    def flush(self):
+        """Waits for every queued event to be delivered"""
+        self.client.flush()
+
+    def close(self):
+        """Delivers the queued events"""
+        self.flush()
+
+    def __len__(self):
+        """Number of events waiting in the local queue or for acknowledgement"""
+        return len(self.client)
+
+
+class NullSink:
+    """Discards events, counting them as delivered.
+
+    Measures the simulation and serialization without any broker. Also the base of the other
+    local sinks.
+    """
+
+    requires_services = False
+
+    def create_topic(self, topic_name, num_partitions, num_replicas):
+        """Local sinks have no topics to create"""
+
+    def produce(self, producer, timestamp_ms, key, value):
+        """Delivers the event"""
+        producer.on_delivery(None, None)
+
+    def flush(self):
+        """Local sinks deliver events immediately"""
+
+    def close(self):
+        """Releases the resources of the sink"""
+
+    def __len__(self):
+        return 0
+
+
+class MemorySink(NullSink):
+    """Keeps the latest `capacity` events in memory as (topic, event time, key, value) tuples"""
+
+    def __init__(self, capacity):
+        self.events = deque(maxlen=capacity)
+
+    def produce(self, producer, timestamp_ms, key, value):
+        self.events.append((producer.topic_name, timestamp_ms, key, value))
+        producer.on_delivery(None, None)
+
+
+class FileSink(NullSink):
+    """Writes events to a recording file per process in `record_dir`, see `replay.py`"""
+
+    def __init__(self, record_dir):
+        self.recorder = EventRecorder(process_recording_path(record_dir))
+
+    def produce(self, producer, timestamp_ms, key, value):
+        self.recorder.write(producer, timestamp_ms, key, value)
+        producer.on_delivery(None, None)
+
+    def close(self):
+        self.recorder.close()
+
+
+def sink_from_env():
+    """Creates the sink selected by `PRODUCER_SINK`: kafka, null, memory or file"""
+    name = os.getenv('PRODUCER_SINK', 'kafka')
+    if name == "kafka":
+        return KafkaSink()
+    if name == "null":
+        return NullSink()
+    if name == "memory":
+        return MemorySink(int(os.getenv('PRODUCER_SINK_CAPACITY', '100000')))
+    if name == "file":
+        return FileSink(os.getenv('PRODUCER_SINK_PATH', 'events'))
+    raise ValueError(
+        f'Invalid PRODUCER_SINK {name}. Expected one of kafka, null, memory or file'
+    )
@@ -1,10 +1,9 @@
 """Methods pertaining to loading and configuring CTA "L" station data."""
 import logging
-from pathlib import Path
-
-from confluent_kafka import avro
+import os
 
 from models import Turnstile
+from models.arrival_batch import ArrivalBatch
 from models.producer import Producer
 from models.train import Train
 
@@ -15,6 +14,11 @@ logger = logging.getLogger(__name__)
 class Station():
     """Defines a single station"""
     _producer: Producer = None
+    _batch_producer: Producer = None
+
+    # "per_arrival" emits one event per train arrival, "batched" one event per line and tick
+    arrival_modes = ("per_arrival", "batched")
+    arrival_mode = os.getenv('ARRIVAL_MODE', 'per_arrival')
 
     def __init__(self, station_id, name, color, direction_a=None, direction_b=None):
         self.name = name
@@ -24,28 +28,56 @@ class Station():
         self.dir_b = direction_b
         self.a_train = None
         self.b_train = None
+        # Set by the line when arrivals are batched
+        self.arrival_batch: ArrivalBatch = None
         self.turnstile = Turnstile(self)
         Station._init_producer_singleton()
 
     @classmethod
     def _init_producer_singleton(cls):
-        if cls._producer is None:
-            key_schema = avro.load(f"{Path(__file__).parents[0]}/schemas/arrival_key.json")
-            value_schema = avro.load(f"{Path(__file__).parents[0]}/schemas/arrival_value.json")
+        if cls.arrival_mode not in cls.arrival_modes:
+            raise ValueError(
+                f'Invalid ARRIVAL_MODE {cls.arrival_mode}. Expected one of {cls.arrival_modes}'
+            )
+        if cls._producer is None and cls.arrival_mode == "per_arrival":
             cls._producer = Producer(
                 'com.udacity.project.chicago_transportation.arrival',
-                key_schema=key_schema,
-                value_schema=value_schema
+                key_schema='arrival_key',
+                value_schema='arrival_value'
+            )
+        if cls._batch_producer is None and cls.arrival_mode == "batched":
+            cls._batch_producer = Producer(
+                'com.udacity.project.chicago_transportation.arrival.batch',
+                key_schema='arrival_key',
+                value_schema='arrival_batch_value'
             )
 
+    @classmethod
+    def produce_batch(cls, arrival_batch: ArrivalBatch):
+        """Emits the arrivals collected for a line and empties the batch"""
+        if len(arrival_batch) == 0:
+            return
+        cls._batch_producer.produce(arrival_batch.to_record())
+        arrival_batch.clear()
+
     def run(self, train: Train, direction: str, prev_station_id: int, prev_direction: str):
         """Simulates train arrivals at this station"""
+        if self.arrival_batch is not None:
+            self.arrival_batch.add(
+                self.station_id,
+                train.train_id,
+                direction,
+                train.status.name,
+                prev_station_id,
+                prev_direction
+            )
+            return
 
         Station._producer.produce({
             "station_id": self.station_id,
             "train_id": train.train_id,
             "direction": direction,
-            "line": self.color.name,
+            "line": self.color,
             "train_status": train.status.name,
             "prev_station_id": prev_station_id,
             "prev_direction": prev_direction
@@ -77,4 +109,7 @@ class Station():
     def close(self):
         """Prepares the producer for exit by cleaning up the producer"""
         self.turnstile.close()
-        Station._producer.close()
+        if Station._producer is not None:
+            Station._producer.close()
+        if Station._batch_producer is not None:
+            Station._batch_producer.close()
@@ -1,8 +1,7 @@
 """Creates a turnstile data producer"""
+import datetime
 import logging
-from pathlib import Path
-
-from confluent_kafka import avro
+import os
 
 from models.producer import Producer
 from models.turnstile_hardware import TurnstileHardware
@@ -14,33 +13,71 @@ logger = logging.getLogger(__name__)
 class Turnstile():
     _producer: Producer = None
 
+    # "aggregated" emits one event per station and time step carrying the number of entries,
+    # "per_rider" keeps the legacy behaviour of emitting one event per rider.
+    modes = ("aggregated", "per_rider")
+    mode = os.getenv('TURNSTILE_MODE', 'aggregated')
+
     def __init__(self, station):
         """Create the Turnstile"""
         self.station = station
-        self.turnstile_hardware = TurnstileHardware(station)
+        self._turnstile_hardware = None
         Turnstile._init_producer_singleton()
 
     @classmethod
     def _init_producer_singleton(cls):
+        if cls.mode not in cls.modes:
+            raise ValueError(f'Invalid TURNSTILE_MODE {cls.mode}. Expected one of {cls.modes}')
         if cls._producer is None:
-            key_schema = avro.load(f"{Path(__file__).parents[0]}/schemas/turnstile_key.json")
-            value_schema = avro.load(f"{Path(__file__).parents[0]}/schemas/turnstile_value.json")
             cls._producer = Producer(
                 'com.udacity.project.chicago_transportation.station.turstile_entries',
-                key_schema=key_schema,
-                value_schema=value_schema
+                key_schema='turnstile_key',
+                value_schema='turnstile_value'
             )
 
-    def run(self, timestamp, time_step):
-        """Simulates riders entering through the turnstile."""
-        num_entries = self.turnstile_hardware.get_entries(timestamp, time_step)
+    @property
+    def turnstile_hardware(self):
+        """Per-station ridership model, only loaded when entries are not computed network-wide"""
+        if self._turnstile_hardware is None:
+            self._turnstile_hardware = TurnstileHardware(self.station)
+        return self._turnstile_hardware
+
+    def run(self, timestamp, time_step, num_entries=None):
+        """Simulates riders entering through the turnstile.
+
+        `num_entries` may be provided when entries were already computed for the whole network.
+        """
+        if num_entries is None:
+            num_entries = self.turnstile_hardware.get_entries(timestamp, time_step)
+        if num_entries <= 0:
+            return
+
+        if Turnstile.mode == "per_rider":
+            for _ in range(num_entries):
+                Turnstile._producer.produce(self._event_value())
+            return
+
+        window_start = self._epoch_millis(timestamp)
+        Turnstile._producer.produce(self._event_value(
+            num_entries=num_entries,
+            window_start=window_start,
+            window_end=window_start + int(time_step.total_seconds() * 1000),
+        ))
+
+    def _event_value(self, num_entries=1, window_start=None, window_end=None):
+        return {
+            "station_id": self.station.station_id,
+            "station_name": self.station.name,
+            "line": self.station.color,
+            "num_entries": num_entries,
+            "window_start": window_start,
+            "window_end": window_end,
+        }
 
-        for _ in range(num_entries):
-            Turnstile._producer.produce({
-                "station_id": self.station.station_id,
-                "station_name": self.station.name,
-                "line": self.station.color.name,
-            })
+    @staticmethod
+    def _epoch_millis(timestamp):
+        """Converts a naive UTC simulation timestamp into epoch milliseconds"""
+        return int(timestamp.replace(tzinfo=datetime.timezone.utc).timestamp() * 1000)
 
     def close(self):
         Turnstile._producer.close()
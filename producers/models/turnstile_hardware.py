@@ -14,6 +14,8 @@ logger = logging.getLogger(__name__)
 class TurnstileHardware:
     curve_df = None
     seed_df = None
+    # Replaced with a seeded generator for reproducible simulations
+    rand = random.Random()
 
     def __init__(self, station):
         """Create the Turnstile"""
@@ -63,4 +65,4 @@ class TurnstileHardware:
         # Calculate approximation of number of entries for this simulation step
         num_entries = int(math.floor(num_riders * ratio / total_steps))
         # Introduce some randomness in the data
-        return max(num_entries + random.choice(range(-5, 5)), 0)
+        return max(num_entries + TurnstileHardware.rand.choice(range(-5, 5)), 0)
@@ -1,13 +1,11 @@
 """Methods pertaining to weather data"""
 from enum import IntEnum
-import json
 import logging
-from pathlib import Path
 import random
 import os
-import requests
 
 from models.producer import Producer
+from models.rest_proxy import RestProxyPublisher
 
 
 logger = logging.getLogger(__name__)
@@ -19,21 +17,21 @@ class Weather(Producer):
     status = IntEnum(
         "status", "sunny partly_cloudy cloudy windy precipitation", start=0
     )
-    key_schema = None
-    value_schema = None
 
     winter_months = set((0, 1, 2, 3, 10, 11))
     summer_months = set((6, 7, 8))
 
-    def __init__(self, month):
+    def __init__(self, month, seed=None):
+        """Creates the weather producer. Readings are reproducible when `seed` is given."""
         super().__init__(
             "com.udacity.project.chicago_transportation.weather.update",
-            key_schema=Weather.key_schema,
-            value_schema=Weather.value_schema,
+            key_schema='weather_key',
+            value_schema='weather_value',
             num_partitions=5,
             num_replicas=1
         )
 
+        self.rand = random.Random(seed)
         self.status = Weather.status.sunny
         self.temp = 70.0
         if month in Weather.winter_months:
@@ -41,13 +39,16 @@ class Weather(Producer):
         elif month in Weather.summer_months:
             self.temp = 85.0
 
-        if Weather.key_schema is None:
-            with open(f"{Path(__file__).parents[0]}/schemas/weather_key.json") as f:
-                Weather.key_schema = json.load(f)
-
-        if Weather.value_schema is None:
-            with open(f"{Path(__file__).parents[0]}/schemas/weather_value.json") as f:
-                Weather.value_schema = json.load(f)
+        # Readings go through REST Proxy when producing to Kafka, local sinks get them directly
+        self.publisher = None
+        if self.sink.requires_services:
+            self.publisher = RestProxyPublisher(
+                os.getenv('REST_PROXY_URL'),
+                self.topic_name,
+                key_schema=self.serializer.schemas[self.key_schema],
+                value_schema=self.serializer.schemas[self.value_schema],
+                on_delivery=self.on_delivery,
+            )
 
     def _set_weather(self, month):
         """Returns the current weather"""
@@ -56,44 +57,40 @@ class Weather(Producer):
             mode = -1.0
         elif month in Weather.summer_months:
             mode = 1.0
-        self.temp += min(max(-20.0, random.triangular(-10.0, 10.0, mode)), 100.0)
-        self.status = random.choice(list(Weather.status))
+        self.temp += min(max(-20.0, self.rand.triangular(-10.0, 10.0, mode)), 100.0)
+        self.status = self.rand.choice(list(Weather.status))
 
     def run(self, month):
+        """Publishes a new weather reading without waiting for REST Proxy"""
         self._set_weather(month)
-
-        event_key = { 'timestamp': self.time_millis() }
-        event_value = {
+        timestamp = self.time_millis()
+        key = {'timestamp': timestamp}
+        value = {
             'status': Weather.status(self.status).name,
             'temperature': self.temp
         }
-        resp = requests.post(
-            f"{os.getenv('REST_PROXY_URL')}/topics/{self.topic_name}",
-            headers={"Content-Type": "application/vnd.kafka.avro.v2+json"},
-            data=json.dumps(
-                {
-                    'key_schema': json.dumps(Weather.key_schema),
-                    'value_schema': json.dumps(Weather.value_schema),
-                    'records': [{
-                        'key': event_key,
-                        'value': event_value
-                    }]
-                }
-            ),
-        )
-        try:
-            resp.raise_for_status()
-        except Exception as e:
-            logger.error(f"""
-                Failed to send event to topic {self.topic_name} throughout Rest API.
-                key: {json.dumps(event_key)}
-                value: {json.dumps(event_value)}
-                exception: ${e}
-                response: {resp.text}
-            """)
+        if self.publisher is None:
+            self.produce(value)
+            return
+        # Counted before publishing, the background thread may report delivery right away
+        self.produced += 1
+        self.publisher.publish(key, value)
+        if Producer.recorder is not None:
+            Producer.recorder.write(
+                self,
+                timestamp,
+                self.serializer.encode(self.key_subject, self.key_schema, key),
+                self.serializer.encode(self.value_subject, self.value_schema, value),
+            )
 
         logger.debug(
             "sent weather data to kafka, temp: %s, status: %s",
             self.temp,
             self.status.name,
         )
+
+    def close(self):
+        """Sends pending weather readings and cleans up the producer"""
+        if self.publisher is not None:
+            self.publisher.close()
+        super().close()
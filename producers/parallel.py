@@ -0,0 +1,140 @@
+"""Advances train lines in worker processes that stay in lock-step with the simulation"""
+import datetime
+import logging
+import multiprocessing
+import signal
+from threading import BrokenBarrierError
+import time
+
+from common import metrics
+from models import Line, RidershipEngine
+from models.producer import Producer
+
+
+logger = logging.getLogger(__name__)
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+WORKER_TICK_SECONDS = metrics.Histogram(
+    "simulation_worker_tick_seconds", "Time a line worker spent advancing its lines for a tick"
+)
+
+
+class LineWorkerPool:
+    """Shards train lines across processes, each one owning its own producers.
+
+    Every tick the simulation publishes the simulated time and releases the workers through a
+    barrier, then waits on the same barrier until every worker has finished the tick.
+    """
+
+    barrier_timeout = 60
+
+    def __init__(self, line_specs, num_workers, time_step, ridership_paths, start_time,
+                 seed=None, record_dir=None, metrics_port=None):
+        """`line_specs` is a list of (line name, station dataframe, number of trains) tuples and
+        `ridership_paths` the (curve, seed) data files for the workers' ridership engines.
+        `start_time` is the simulated time when the workers place their trains.
+
+        With a `seed`, each worker seeds its ridership engine from it and keys events with the
+        simulated time. With `record_dir`, each worker records its events to its own file.
+        With `metrics_port`, each worker serves its metrics on the following ports.
+        """
+        context = multiprocessing.get_context("spawn")
+        shards = [line_specs[i::num_workers] for i in range(num_workers)]
+        shards = [shard for shard in shards if shard]
+
+        self.barrier = context.Barrier(len(shards) + 1)
+        self.tick_time = context.Value("d", (start_time - EPOCH).total_seconds(), lock=False)
+        self.stop = context.Value("b", 0, lock=False)
+        self._tick_pending = False
+        self.workers = [
+            context.Process(
+                target=_run_worker,
+                name=f"line-worker-{index}",
+                args=(
+                    shard,
+                    time_step,
+                    ridership_paths,
+                    None if seed is None else seed + index,
+                    record_dir,
+                    None if metrics_port is None else metrics_port + 1 + index,
+                    self.barrier,
+                    self.tick_time,
+                    self.stop,
+                ),
+                daemon=True,
+            )
+            for index, shard in enumerate(shards)
+        ]
+        for worker in self.workers:
+            worker.start()
+        logger.info(
+            "started %s line workers: %s",
+            len(shards),
+            [[spec[0] for spec in shard] for shard in shards]
+        )
+
+    def run_tick(self, timestamp):
+        """Runs one tick on every worker and returns when all of them are done"""
+        self.tick_time.value = (timestamp - EPOCH).total_seconds()
+        self.barrier.wait(LineWorkerPool.barrier_timeout)
+        self._tick_pending = True
+        self.barrier.wait(LineWorkerPool.barrier_timeout)
+        self._tick_pending = False
+
+    def close(self):
+        """Stops the workers, letting them flush their producers"""
+        try:
+            if self._tick_pending:
+                self.barrier.wait(LineWorkerPool.barrier_timeout)
+            self.stop.value = 1
+            self.barrier.wait(LineWorkerPool.barrier_timeout)
+        except BrokenBarrierError:
+            logger.error("line workers did not stop cleanly")
+
+        for worker in self.workers:
+            worker.join(LineWorkerPool.barrier_timeout)
+            if worker.is_alive():
+                worker.terminate()
+
+
+def _run_worker(line_specs, time_step, ridership_paths, seed, record_dir, metrics_port, barrier,
+                tick_time, stop):
+    """Worker process loop, advancing its lines once per tick"""
+    # Shutdown is coordinated by the main process through the stop flag
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if metrics_port is not None:
+        metrics.serve(metrics_port)
+    if record_dir is not None:
+        Producer.record_to(record_dir)
+    if seed is not None:
+        Producer.set_simulated_time(EPOCH + datetime.timedelta(seconds=tick_time.value))
+
+    curve_path, seed_path = ridership_paths
+    ridership = RidershipEngine(seed=seed, curve_path=curve_path, seed_path=seed_path)
+    lines = [
+        Line(name, station_df, num_trains=num_trains, ridership=ridership)
+        for name, station_df, num_trains in line_specs
+    ]
+    tick_seconds = WORKER_TICK_SECONDS.labels()
+    try:
+        while True:
+            barrier.wait()
+            if stop.value:
+                break
+            tick_start = time.perf_counter()
+            timestamp = EPOCH + datetime.timedelta(seconds=tick_time.value)
+            if seed is not None:
+                Producer.set_simulated_time(timestamp)
+            entries = ridership.get_entries(timestamp, time_step)
+            _ = [line.run(timestamp, time_step, entries) for line in lines]
+            tick_seconds.observe(time.perf_counter() - tick_start)
+            barrier.wait()
+    except Exception:
+        logger.exception("line worker failed")
+        barrier.abort()
+        raise
+    finally:
+        _ = [line.close() for line in lines]
+        Producer.close_sinks()
+        Producer.log_stats()
@@ -0,0 +1,111 @@
+"""Replays events recorded by `simulation.py --record` into Kafka.
+
+Recordings of every process are merged in event time order. Events are produced exactly as
+recorded, only their schema ids are replaced with the ids of the target schema registry.
+"""
+import argparse
+import heapq
+import logging
+import logging.config
+from pathlib import Path
+import struct
+import sys
+import time
+
+from dotenv import load_dotenv
+
+# Import logging before models to ensure configuration is picked up
+logging.config.fileConfig(f"{Path(__file__).parents[0]}/logging.ini")
+# Modules shared with the consumers live at the repository root
+sys.path.append(str(Path(__file__).parents[1]))
+
+from models.producer import Producer
+from models.recorder import FILE_SUFFIX, read_events
+from models.serialization import HEADER_FORMAT, MAGIC_BYTE
+
+logger = logging.getLogger(__name__)
+load_dotenv()
+
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+
+
+class TopicReplayer:
+    """Produces the recorded events of a topic with the schema ids of the target registry"""
+
+    def __init__(self, topic):
+        self.producer = Producer(
+            topic["name"],
+            key_schema=topic["key_schema"],
+            value_schema=topic["value_schema"],
+            num_partitions=topic["num_partitions"],
+        )
+        self.key_header = self._header(self.producer.key_subject, topic["key_schema"])
+        self.value_header = self._header(self.producer.value_subject, topic["value_schema"])
+
+    def _header(self, subject, schema_name):
+        schema_id = self.producer.serializer.register(subject, schema_name)
+        return struct.pack(HEADER_FORMAT, MAGIC_BYTE, schema_id)
+
+    def produce(self, timestamp_ms, key, value):
+        """Produces a recorded event"""
+        self.producer.produce_encoded(
+            self.key_header + key[HEADER_SIZE:],
+            self.value_header + value[HEADER_SIZE:],
+            timestamp_ms,
+        )
+
+
+def replay(record_dir, rate=0):
+    """Produces every recorded event, at `rate` events per second or as fast as possible if 0"""
+    paths = sorted(Path(record_dir).glob(f"*{FILE_SUFFIX}"))
+    if not paths:
+        raise ValueError(f"No recordings found in {record_dir}")
+    logger.info("replaying %s", ", ".join(path.name for path in paths))
+
+    events = heapq.merge(*(read_events(path) for path in paths), key=lambda event: event[0])
+    replayers = {}
+    replayed = 0
+    start = time.monotonic()
+    try:
+        for timestamp_ms, topic, key, value in events:
+            replayer = replayers.get(topic["name"])
+            if replayer is None:
+                replayer = replayers[topic["name"]] = TopicReplayer(topic)
+            replayer.produce(timestamp_ms, key, value)
+            replayed += 1
+            if rate > 0:
+                # Paced from the start so time spent producing does not accumulate as drift
+                delay = start + replayed / rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+
+    _ = [replayer.producer.close() for replayer in replayers.values()]
+    Producer.close_sinks()
+    Producer.log_stats()
+    elapsed = time.monotonic() - start
+    logger.info(
+        "replayed %s events in %.1f seconds: %.1f events per second",
+        replayed,
+        elapsed,
+        replayed / elapsed if elapsed > 0 else float("inf"),
+    )
+
+
+def parse_args(args=None):
+    """Parses the replay command line arguments"""
+    parser = argparse.ArgumentParser(description="Replays recorded simulation events into Kafka")
+    parser.add_argument("record_dir", help="directory passed to simulation.py --record")
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=0,
+        help="events per second to produce, 0 replays as fast as possible",
+    )
+    return parser.parse_args(args)
+
+
+if __name__ == "__main__":
+    arguments = parse_args()
+    replay(arguments.record_dir, arguments.rate)
@@ -1,40 +1,84 @@
 """Defines a time simulation responsible for executing any registered
 producers
 """
+import argparse
 import datetime
+import random
 import time
 from enum import IntEnum
 import logging
 import logging.config
+import os
 from pathlib import Path
+import sys
 
 from dotenv import load_dotenv
 import pandas as pd
 
-# Import logging before models to ensure configuration is picked up
-logging.config.fileConfig(f"{Path(__file__).parents[0]}/logging.ini")
+# Import logging before models to ensure configuration is picked up. Scripts importing the
+# simulation, such as benchmark.py, configure logging first and keep their loggers.
+logging.config.fileConfig(
+    f"{Path(__file__).parents[0]}/logging.ini", disable_existing_loggers=False
+)
+# Modules shared with the consumers live at the repository root
+sys.path.append(str(Path(__file__).parents[1]))
 
+from common import metrics
+from common.profiler import FORMATS, Profiler
 from connector import configure_connector
-from models import Line, Weather
+from models import Line, RidershipEngine, Weather
+from models.producer import Producer
+from models.turnstile_hardware import TurnstileHardware
+from parallel import LineWorkerPool
 
 logger = logging.getLogger(__name__)
 load_dotenv()
 
+TICK_SECONDS = metrics.Histogram(
+    "simulation_tick_seconds", "Time spent simulating a tick, including the line workers"
+)
+
 class TimeSimulation:
     weekdays = IntEnum("weekdays", "mon tue wed thu fri sat sun", start=0)
     ten_min_frequency = datetime.timedelta(minutes=10)
 
-    def __init__(self, sleep_seconds=5, time_step=None, schedule=None):
-        """Initializes the time simulation"""
+    default_data_dir = Path(__file__).parents[0] / "data"
+    # Seeded runs start at a fixed time unless told otherwise, so they can be reproduced
+    default_seeded_start = datetime.datetime(2019, 10, 1)
+
+    def __init__(
+        self,
+        sleep_seconds=5,
+        time_step=None,
+        schedule=None,
+        seed=None,
+        num_workers=0,
+        data_dir=None,
+        record_dir=None,
+        profiler=None,
+        metrics_port=None,
+    ):
+        """Initializes the time simulation.
+
+        With `num_workers` greater than 0 the train lines are advanced in worker processes.
+        `data_dir` may point to a network created by `generate_network.py`.
+
+        A `seed` makes the simulation deterministic: random numbers are seeded and events are
+        keyed with the simulated time. With `record_dir` every produced event is also written
+        to a file per process in that directory, to be replayed with `replay.py`.
+
+        A `profiler` is given the duration of every tick, to keep the slowest ones, and is
+        closed when the simulation ends. With `metrics_port` the simulation serves its metrics
+        on that port and the line workers on the following ones.
+        """
         self.sleep_seconds = sleep_seconds
         self.time_step = time_step
         if self.time_step is None:
             self.time_step = datetime.timedelta(minutes=self.sleep_seconds)
 
         # Read data from disk
-        self.raw_df = pd.read_csv(
-            f"{Path(__file__).parents[0]}/data/cta_stations.csv"
-        ).sort_values("order")
+        data_dir = Path(data_dir or TimeSimulation.default_data_dir)
+        self.raw_df = pd.read_csv(data_dir / "cta_stations.csv").sort_values("order")
 
         # Define the train schedule (same for all trains)
         self.schedule = schedule
@@ -49,35 +93,250 @@ class TimeSimulation:
                 TimeSimulation.weekdays.sun: {0: TimeSimulation.ten_min_frequency},
             }
 
-        self.train_lines = [
-            Line(Line.colors.blue, self.raw_df[self.raw_df["blue"]]),
-            Line(Line.colors.red, self.raw_df[self.raw_df["red"]]),
-            Line(Line.colors.green, self.raw_df[self.raw_df["green"]]),
+        # Every column after "order" flags the stations served by one line
+        line_names = self.raw_df.columns[self.raw_df.columns.get_loc("order") + 1:]
+        num_trains = TimeSimulation._load_num_trains(data_dir)
+        self.line_specs = [
+            (name, self.raw_df[self.raw_df[name]], num_trains.get(name, Line.default_num_trains))
+            for name in line_names
         ]
+        self.seed = seed
+        self.record_dir = record_dir
+        self.profiler = profiler
+        self.metrics_port = metrics_port
+        self.num_workers = num_workers
+        self.worker_pool = None
 
-    def run(self):
-        curr_time = datetime.datetime.utcnow().replace(
-            hour=0, minute=0, second=0, microsecond=0
+        # Turnstile entries for all stations are computed once per tick
+        self.ridership_paths = (
+            TimeSimulation._data_file(data_dir, "ridership_curve.csv"),
+            TimeSimulation._data_file(data_dir, "ridership_seed.csv"),
         )
+        self.ridership = RidershipEngine(
+            seed=seed, curve_path=self.ridership_paths[0], seed_path=self.ridership_paths[1]
+        )
+
+        # Built when the simulation runs, as placing the trains already produces arrivals
+        self.train_lines = []
+
+    @staticmethod
+    def _data_file(data_dir, file_name):
+        """Returns the file from the data directory, falling back to the bundled CTA data"""
+        path = data_dir / file_name
+        if path.exists():
+            return path
+        return TimeSimulation.default_data_dir / file_name
+
+    @staticmethod
+    def _load_num_trains(data_dir):
+        """Returns the number of trains per line when the network defines it"""
+        path = data_dir / "lines.csv"
+        if not path.exists():
+            return {}
+        lines_df = pd.read_csv(path)
+        return dict(zip(lines_df["line"], lines_df["num_trains"]))
+
+    def run(self, start_time=None, end_time=None, speed=None):
+        """Runs the simulation from `start_time` until `end_time` or until interrupted.
+
+        `speed` is the target multiple of real time. When it is None the simulation advances
+        `time_step` every `sleep_seconds`, and a speed of 0 runs headless, as fast as the
+        producers can absorb events.
+        """
+        curr_time = start_time
+        if curr_time is None and self.seed is not None:
+            curr_time = TimeSimulation.default_seeded_start
+        elif curr_time is None:
+            curr_time = datetime.datetime.utcnow().replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+        if self.seed is not None:
+            TurnstileHardware.rand = random.Random(self.seed)
+            Producer.set_simulated_time(curr_time)
+        if self.record_dir is not None:
+            Producer.record_to(self.record_dir)
+        if speed is None:
+            speed = 0
+            if self.sleep_seconds > 0:
+                speed = self.time_step.total_seconds() / self.sleep_seconds
+
         logger.info("Beginning simulation, press Ctrl+C to exit at any time")
-        logger.info("loading kafka connect jdbc source connector")
-        configure_connector()
+        if Producer.get_sink().requires_services:
+            logger.info("loading kafka connect jdbc source connector")
+            configure_connector()
+        if self.metrics_port is not None:
+            metrics.serve(self.metrics_port)
 
-        logger.info("beginning cta train simulation")
-        weather = Weather(curr_time.month)
+        logger.info(
+            "beginning cta train simulation %s",
+            f"at {speed:g}x real time" if speed > 0 else "in headless mode"
+        )
+        weather = Weather(curr_time.month, seed=self.seed)
+        if self.num_workers > 0:
+            self.worker_pool = LineWorkerPool(
+                self.line_specs,
+                self.num_workers,
+                self.time_step,
+                self.ridership_paths,
+                curr_time,
+                self.seed,
+                self.record_dir,
+                self.metrics_port,
+            )
+        else:
+            self.train_lines = [
+                Line(name, station_df, num_trains=trains, ridership=self.ridership)
+                for name, station_df, trains in self.line_specs
+            ]
+        sim_start = curr_time
+        wall_start = time.monotonic()
+        tick_seconds = TICK_SECONDS.labels()
         try:
-            while True:
+            while end_time is None or curr_time < end_time:
+                tick_start = time.perf_counter()
                 logger.debug("simulation running: %s", curr_time.isoformat())
+                if self.seed is not None:
+                    Producer.set_simulated_time(curr_time)
                 # Send weather on the top of the hour
                 if curr_time.minute == 0:
                     weather.run(curr_time.month)
-                _ = [line.run(curr_time, self.time_step) for line in self.train_lines]
+                    Producer.log_stats()
+                if self.worker_pool is not None:
+                    self.worker_pool.run_tick(curr_time)
+                else:
+                    entries = self.ridership.get_entries(curr_time, self.time_step)
+                    _ = [line.run(curr_time, self.time_step, entries) for line in self.train_lines]
+                tick_duration = time.perf_counter() - tick_start
+                tick_seconds.observe(tick_duration)
+                if self.profiler is not None:
+                    self.profiler.record(tick_duration, "tick %s", curr_time.isoformat())
                 curr_time = curr_time + self.time_step
-                time.sleep(self.sleep_seconds)
+                if speed > 0:
+                    TimeSimulation._wait_for_schedule(wall_start, curr_time - sim_start, speed)
         except KeyboardInterrupt:
             logger.info("Shutting down")
-            _ = [line.close() for line in self.train_lines]
+
+        weather.close()
+        _ = [line.close() for line in self.train_lines]
+        if self.worker_pool is not None:
+            self.worker_pool.close()
+        Producer.close_sinks()
+        if self.profiler is not None:
+            self.profiler.close()
+        Producer.log_stats()
+        wall_elapsed = time.monotonic() - wall_start
+        sim_minutes = (curr_time - sim_start).total_seconds() / 60
+        logger.info(
+            "simulated %s to %s: %.1f simulated minutes per second",
+            sim_start.isoformat(),
+            curr_time.isoformat(),
+            sim_minutes / wall_elapsed if wall_elapsed > 0 else float("inf"),
+        )
+
+    @staticmethod
+    def _wait_for_schedule(wall_start, sim_elapsed, speed):
+        """Sleeps until the wall clock catches up with the simulated time.
+
+        The deadline is computed from the start of the run rather than from the end of the last
+        tick so time spent producing events does not accumulate as drift.
+        """
+        deadline = wall_start + sim_elapsed.total_seconds() / speed
+        delay = deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+def parse_args(args=None):
+    """Parses the simulation command line arguments"""
+    parser = argparse.ArgumentParser(description="Simulates CTA train lines and riders")
+    parser.add_argument(
+        "--start",
+        type=datetime.datetime.fromisoformat,
+        help="simulated start time in ISO format (UTC), defaults to today at midnight",
+    )
+    parser.add_argument(
+        "--end",
+        type=datetime.datetime.fromisoformat,
+        help="simulated end time in ISO format (UTC), runs until interrupted if omitted",
+    )
+    parser.add_argument(
+        "--time-step", type=float, default=5.0, help="simulated minutes per tick"
+    )
+    pace = parser.add_mutually_exclusive_group()
+    pace.add_argument(
+        "--speed", type=float, default=60.0, help="target multiple of real time, e.g. 60"
+    )
+    pace.add_argument(
+        "--headless", action="store_true", help="run as fast as events can be produced"
+    )
+    parser.add_argument(
+        "--data-dir",
+        help="directory holding the network data, defaults to the bundled CTA network",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="number of processes to shard train lines across, 0 runs them in this process",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        help="seed for a deterministic run, starting on "
+        f"{TimeSimulation.default_seeded_start.date()} unless --start is given",
+    )
+    parser.add_argument(
+        "--record", help="directory to record the produced events to, see replay.py"
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        default=os.getenv("SIMULATION_METRICS_PORT") or None,
+        help="port to serve Prometheus metrics on, line workers use the following ones. "
+        "Defaults to SIMULATION_METRICS_PORT, no metrics are served without either",
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="sample the stack for the first --profile-seconds of the run"
+    )
+    parser.add_argument(
+        "--profile-seconds", type=float, default=30.0,
+        help="length of the samples taken with --profile and on SIGUSR1"
+    )
+    parser.add_argument(
+        "--profile-slowest", type=int, default=0, metavar="N",
+        help="keep the stacks of the N slowest ticks, written when the simulation ends"
+    )
+    parser.add_argument(
+        "--profile-dir", default="profiles", help="directory the profiles are written to"
+    )
+    parser.add_argument(
+        "--profile-format", choices=FORMATS, default="collapsed",
+        help="collapsed stacks for flamegraph.pl or speedscope JSON"
+    )
+    return parser.parse_args(args)
 
 
 if __name__ == "__main__":
-    TimeSimulation().run()
+    arguments = parse_args()
+    # Samples are only taken once a profiling mode is turned on, by flag or by SIGUSR1
+    simulation_profiler = Profiler(
+        arguments.profile_dir, arguments.profile_format, slowest=arguments.profile_slowest
+    )
+    simulation_profiler.install_signal_handler(arguments.profile_seconds)
+    if arguments.profile:
+        simulation_profiler.sample_for(arguments.profile_seconds)
+    simulation_profiler.start()
+    TimeSimulation(
+        time_step=datetime.timedelta(minutes=arguments.time_step),
+        num_workers=arguments.workers,
+        data_dir=arguments.data_dir,
+        seed=arguments.seed,
+        record_dir=arguments.record,
+        profiler=simulation_profiler,
+        metrics_port=arguments.metrics_port,
+    ).run(
+        start_time=arguments.start,
+        end_time=arguments.end,
+        speed=0 if arguments.headless else arguments.speed,
+    )